@@ -1,5 +1,5 @@
 import os
-import json
+import atexit
 import datetime
 import shutil
 from functools import wraps
@@ -23,26 +23,43 @@ from helper import (
     token_required,
     generateId,
     get_query_list,
+    encode_cursor,
+    decode_cursor,
+    register_change_listener,
     initialize_mail,
     send_periodic_notifications,
     send_email_notification,
     JWT_SECRET,
-    DATABASE_FILE,
+    QUERY_CACHE_MAX_MB,
+    QUERY_CACHE_TTL,
+    COLUMNAR_PRODUCTS,
+    DEV_RELOADER,
+    COMPRESS_MIN_BYTES,
+    CLICK_MERGE_INTERVAL_MS,
+    MAX_EVENT_BATCH,
+    STREAM_MIN_ITEMS,
     CATEGORIES_FILE,
     initialize_blacklist
 )
 from user_authenticator import register, delete_user, login, logout, get_profile, edit_profile, change_password
 from brand_function import (
+    BrandSummaries,
     add_brand,
     delete_brand,
     edit_brand,
     get_all_brands,
     get_single_brand,
+    get_brand_logo,
+    migrate_brand_logos,
     follow_brand,
     unfollow_brand,
 )
 from product_function import (
+    ProductSummaries,
     get_products,
+    get_product_facets,
+    get_size_matrix,
+    get_suggestions,
     get_single_product,
     add_product,
     upload_product_image,
@@ -50,7 +67,19 @@ from product_function import (
     delete_product,
     edit_product
 )
+from product_index import ProductIndex
+from query_cache import QueryCache
+from click_counters import ClickCounters, EVENT_TYPES, parse_event_time
+from click_history import ClickHistory, parse_window
+from metrics_index import MetricsIndex
+from user_index import UserIndex, SORT_FIELDS as USER_SORT_FIELDS
+from compression import init_compression
+from streaming import stream_list, wants_ndjson
+from search_index import SearchIndex
+from suggest_index import SuggestIndex
 import threading
+import signal
+import sys
 import time
 import base64
 
@@ -85,6 +114,7 @@ swagger_template = {
 }
 
 swagger = Swagger(app, template=swagger_template)
+init_compression(app, COMPRESS_MIN_BYTES)
 mail = Mail(app)
 
 initialize_mail(mail)
@@ -122,8 +152,37 @@ def verify_reset_token(token):
 
 # Initialize data
 load_data(users, brands, products)
+migrate_brand_logos(users, brands, products)
+brand_summaries = BrandSummaries(brands)
+register_change_listener("brands", brand_summaries.refresh)
+# Registered first so it is current before the product index bumps the catalog generation
+search_index = SearchIndex(products)
+register_change_listener("products", search_index.refresh)
+product_index = ProductIndex(products, columnar=COLUMNAR_PRODUCTS)
+register_change_listener("products", product_index.refresh_many, batch=True)
+product_summaries = ProductSummaries(products)
+register_change_listener("products", product_summaries.refresh)
+query_cache = QueryCache(QUERY_CACHE_MAX_MB * 1024 * 1024, QUERY_CACHE_TTL)
+click_counters = ClickCounters(
+    products,
+    lambda product_ids: save_data(
+        users, brands, products, [("products", product_id) for product_id in product_ids], durability="async"
+    ),
+    CLICK_MERGE_INTERVAL_MS / 1000,
+)
+atexit.register(click_counters.close)  # Registered after the persistence scheduler, so it runs before it
+click_history = ClickHistory(products)
+register_change_listener("products", click_history.refresh)
+metrics_index = MetricsIndex(users, products)
+register_change_listener("users", metrics_index.refresh_user)
+register_change_listener("products", metrics_index.refresh_product)
+user_index = UserIndex(users)
+register_change_listener("users", user_index.refresh)
 # Initialize categories
 categories = load_categories()
+suggest_index = SuggestIndex(products, brands, categories)
+register_change_listener("products", suggest_index.refresh_product)
+register_change_listener("brands", suggest_index.refresh_brand)
 
 
 def schedule_periodic_notifications(app):
@@ -154,8 +213,9 @@ app.add_url_rule(
 app.add_url_rule("/admin/brands", "add_brand", add_brand(users, products, brands), methods=["POST"])
 app.add_url_rule("/admin/brands/<string:brand_id>", "delete_brand", delete_brand(users, products, brands), methods=["DELETE"])
 app.add_url_rule("/admin/brands/<string:brand_id>", "edit_brand", edit_brand(users, products, brands), methods=["PUT"])
-app.add_url_rule("/brands", "get_all_brands", get_all_brands(brands), methods=["GET"])
+app.add_url_rule("/brands", "get_all_brands", get_all_brands(brands, brand_summaries), methods=["GET"])
 app.add_url_rule("/brands/<string:brand_id>", "get_single_brand", get_single_brand(brands), methods=["GET"])
+app.add_url_rule("/brands/logos/<string:filename>", "get_brand_logo", get_brand_logo(), methods=["GET"])
 app.add_url_rule("/user/follow_brand/<string:brand_id>", "follow_brand", follow_brand(users, products, brands), methods=["POST"])
 app.add_url_rule("/user/unfollow_brand/<string:brand_id>", "unfollow_brand", unfollow_brand(users, products, brands), methods=["POST"])
 
@@ -201,7 +261,10 @@ def forgot_password():
     return jsonify({"message": "Password sent to your email"}), 200
 
 
-app.add_url_rule("/products", "get_products", get_products(products), methods=["GET"])
+app.add_url_rule("/products", "get_products", get_products(product_index, product_summaries, query_cache, search_index), methods=["GET"])
+app.add_url_rule("/products/facets", "get_product_facets", get_product_facets(product_index, query_cache, search_index), methods=["GET"])
+app.add_url_rule("/search/suggest", "get_suggestions", get_suggestions(suggest_index), methods=["GET"])
+app.add_url_rule("/products/sizes", "get_size_matrix", get_size_matrix(product_index), methods=["GET"])
 app.add_url_rule("/products/<string:product_id>", "get_single_product", get_single_product(products), methods=["GET"])
 app.add_url_rule("/admin/products", "add_product", add_product(users, products, brands), methods=["POST"])
 app.add_url_rule("/admin/products/<string:product_id>/upload_image", "upload_product_image", upload_product_image(users, products, brands), methods=["POST"])
@@ -213,26 +276,100 @@ app.add_url_rule("/admin/products/<string:product_id>", "edit_product", edit_pro
 # Endpoint for click count
 @app.route("/products/<string:product_id>/click", methods=["POST"])
 def increment_click_count(product_id):
-    product = products.get(product_id)
-    if not product:
+    if product_id not in products:
         return jsonify({"error": "Product not found"}), 404
 
-    product["click_count"] = product.get("click_count", 0) + 1
-    save_data(users, brands, products)
+    click_counters.add(product_id, "click_count")
+    click_history.record(product_id, "click_count")
 
     return jsonify({"message": "Click count updated"}), 200
 
 @app.route("/products/<string:product_id>/clickthrough", methods=["POST"])
 def increment_click_through_count(product_id):
-    product = products.get(product_id)
-    if not product:
+    if product_id not in products:
         return jsonify({"error": "Product not found"}), 404
 
-    product["click_through_count"] = product.get("click_through_count", 0) + 1
-    save_data(users, brands, products)
+    click_counters.add(product_id, "click_through_count")
+    click_history.record(product_id, "click_through_count")
 
     return jsonify({"message": "Click-through count updated"}), 200
 
+
+@app.route("/products/events:batch", methods=["POST"])
+def record_product_events():
+    """
+    Record a batch of product click and click-through events
+    ---
+    tags:
+      - Products
+    parameters:
+      - name: body
+        in: body
+        schema:
+          type: array
+          items:
+            type: object
+            required:
+              - product_id
+              - type
+            properties:
+              product_id:
+                type: string
+                description: "The product ID, as a string or a number"
+                example: "7347935150157"
+              type:
+                type: string
+                enum: ["click", "clickthrough"]
+              ts:
+                type: number
+                description: "When the event happened, as epoch seconds or an ISO 8601 string (default: now)"
+    responses:
+      200:
+        description: "The number of accepted events and, for each rejected one, its index in the batch and the reason"
+      400:
+        description: The body is not a list of events or holds too many events
+    """
+    events = request.get_json(silent=True)
+    if not isinstance(events, list):
+        return jsonify({"error": "Expected a list of events"}), 400
+    if len(events) > MAX_EVENT_BATCH:
+        return jsonify({"error": f"At most {MAX_EVENT_BATCH} events per batch"}), 400
+
+    accepted = []
+    rejected = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            rejected.append({"index": index, "error": "Event must be an object"})
+            continue
+        field = EVENT_TYPES.get(event.get("type"))
+        if field is None:
+            rejected.append({"index": index, "error": "Unknown event type"})
+            continue
+        product_id = event.get("product_id")
+        if isinstance(product_id, int) and not isinstance(product_id, bool):
+            product_id = str(product_id)  # Some product records keep numeric ids, and listings return them as is
+        if not isinstance(product_id, str) or product_id not in products:
+            rejected.append({"index": index, "error": "Product not found"})
+            continue
+        try:
+            timestamp = parse_event_time(event.get("ts"))
+        except ValueError:
+            rejected.append({"index": index, "error": "Invalid timestamp"})
+            continue
+        accepted.append((product_id, field, timestamp))
+
+    # Recorded only once every event is validated, so a batch is never half applied
+    counts = {}
+    for product_id, field, timestamp in accepted:
+        counts[(product_id, field)] = counts.get((product_id, field), 0) + 1
+        click_history.record(product_id, field, timestamp)
+
+    # Saved along with the other clicks by the next merge
+    for (product_id, field), amount in counts.items():
+        click_counters.add(product_id, field, amount)
+
+    return jsonify({"accepted": len(accepted), "rejected": rejected}), 200
+
 # get a list of users with general data to display (no passwords)
 @app.route("/admin/users", methods=["GET"])
 @token_required(users)
@@ -242,9 +379,39 @@ def get_all_users(current_user):
     ---
     tags:
       - User Management
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: false
+        description: "Only users whose email or name starts with this, ignoring case. Matches are listed in email order"
+      - name: sort_by
+        in: query
+        type: string
+        enum: ["wish_list_count", "followed_brand_count", "notifications_count"]
+        required: false
+        description: "Sort the users by this count"
+      - name: order
+        in: query
+        type: string
+        enum: ["desc", "asc"]
+        required: false
+        description: "Order of sort_by, highest first by default"
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: "Maximum number of users to return. When limit or cursor is given the response is {users, total, next_cursor}"
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: "The next_cursor value of the previous page"
     responses:
       200:
-        description: List of users with details
+        description: "List of users with details. Sent as newline-delimited JSON, with total and next_cursor in the X-Total and X-Next-Cursor headers, when the Accept header asks for application/x-ndjson"
+      400:
+        description: Invalid sort_by, order, limit or cursor
       403:
         description: Unauthorized
     security:
@@ -252,30 +419,34 @@ def get_all_users(current_user):
     """
     if not current_user["is_admin"]:
         return jsonify({"error": "Only admins can access user details"}), 403
-    with open(DATABASE_FILE, "r") as file:
-        data = json.load(file)
-    users = data.get("users", {})
-    user_list = [
-        {
-            "name": user_data["name"],
-            "email": user_data["email"],
-            "followed_brand_count": (
-                len(user_data.get("followed_brand", []))
-                if user_data.get("followed_brand")
-                else 0
-            ),
-            "wish_list_count": (
-                len(user_data.get("wish_list", [])) if user_data.get("wish_list") else 0
-            ),
-            "notifications_count": (
-                len(user_data.get("notifications", []))
-                if user_data.get("notifications")
-                else 0
-            ),
-        }
-        for user_data in users.values()
-    ]
-    return jsonify(user_list), 200
+
+    prefix = request.args.get("q", "").strip()
+    sort_by = request.args.get("sort_by")
+    order = request.args.get("order", "desc")
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    paginated = limit is not None or cursor is not None
+
+    if sort_by is not None and sort_by not in USER_SORT_FIELDS:
+        return jsonify({"error": f"sort_by must be one of {', '.join(USER_SORT_FIELDS)}"}), 400
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "order must be asc or desc"}), 400
+    if limit is not None and limit < 0:
+        return jsonify({"error": "limit must not be negative"}), 400
+    try:
+        offset = decode_cursor(cursor) if cursor else 0
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    user_list, total = user_index.page(prefix, sort_by, order == "desc", offset, limit)
+    envelope = None
+    if paginated:
+        next_offset = offset + len(user_list)
+        envelope = {"total": total, "next_cursor": encode_cursor(next_offset) if next_offset < total else None}
+    ndjson = wants_ndjson()
+    if ndjson or len(user_list) > STREAM_MIN_ITEMS:
+        return stream_list(user_list, envelope, "users" if paginated else None, ndjson), 200
+    return jsonify({"users": user_list, **envelope} if paginated else user_list), 200
 
 
 @app.route("/admin/user", methods=["DELETE"])
@@ -314,22 +485,25 @@ def admin_delete_user(current_user):
         return jsonify({"error": "User not found"}), 404
 
     user_id = user["user_id"]
+    changes = [("users", email_to_delete)]
 
     # Remove the user ID from brand followers_list
-    for brand in brands.values():
+    for brand_id, brand in brands.items():
         if user_id in brand["followers_list"]:
             brand["followers_list"].remove(user_id)
+            changes.append(("brands", brand_id))
 
     # Remove the user ID from product wishlister_users
-    for product in products.values():
+    for product_id, product in products.items():
         if user_id in product["wishlister_users"]:
             product["wishlister_users"].remove(user_id)
+            changes.append(("products", product_id))
 
     # Delete the user account
     del users[email_to_delete]
 
     # Save changes to the database
-    save_data(users, brands, products)
+    save_data(users, brands, products, changes)
 
     return jsonify({"message": "User account deleted successfully"}), 200
 
@@ -378,7 +552,7 @@ def add_to_wishlist(current_user, product_id):
         product["wishlister_users"].append(current_user["user_id"])
 
     # Save the updated data
-    save_data(users, brands, products)
+    save_data(users, brands, products, [("users", current_user["email"]), ("products", product_id)])
 
     return (
         jsonify(
@@ -466,7 +640,7 @@ def remove_from_wishlist(current_user, product_id):
         product["wishlister_users"].remove(current_user["user_id"])
 
     # Save the updated data
-    save_data(users, brands, products)
+    save_data(users, brands, products, [("users", current_user["email"]), ("products", product_id)])
 
     return (
         jsonify(
@@ -529,7 +703,7 @@ def mark_notification_as_read(current_user, notification_id):
     for notification in notifications:
         if notification["id"] == notification_id:
             notification["status"] = "read"
-            save_data(users, brands, products)  # 保存更新后的数据
+            save_data(users, brands, products, [("users", current_user["email"])])  # 保存更新后的数据
             return jsonify({"message": "Notification marked as read"}), 200
 
     return jsonify({"error": "Notification not found"}), 404
@@ -556,7 +730,7 @@ def mark_all_notifications_as_read(current_user):
     notifications = current_user.get("notifications", [])
     for notification in notifications:
         notification["status"] = "read"
-    save_data(users, brands, products)  
+    save_data(users, brands, products, [("users", current_user["email"])])
 
     return jsonify({"message": "All notifications marked as read"}), 200
 
@@ -590,7 +764,7 @@ def delete_notification(current_user, notification_id):
     for notification in notifications:
         if notification["id"] == notification_id:
             notifications.remove(notification)
-            save_data(users, brands, products)  # 保存更新后的数据
+            save_data(users, brands, products, [("users", current_user["email"])])  # 保存更新后的数据
             return jsonify({"message": "Notification deleted successfully"}), 200
 
     return jsonify({"error": "Notification not found"}), 404
@@ -625,7 +799,7 @@ def follow_subcategory(current_user, subcategory):
 
     if subcategory not in current_user["followed_subcategories"]:
         current_user["followed_subcategories"].append(subcategory)
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", current_user["email"])])
 
     return jsonify({"message": f"Followed subcategory: {subcategory}"}), 200
 
@@ -659,7 +833,7 @@ def unfollow_subcategory(current_user, subcategory):
         return jsonify({"error": "Subcategory not followed"}), 400
 
     current_user["followed_subcategories"].remove(subcategory)
-    save_data(users, brands, products)
+    save_data(users, brands, products, [("users", current_user["email"])])
 
     return jsonify({"message": f"Unfollowed subcategory: {subcategory}"}), 200
 
@@ -678,6 +852,12 @@ def get_metrics(current_user):
       - Metrics
     security:
       - Bearer: []
+    parameters:
+      - name: window
+        in: query
+        type: string
+        required: false
+        description: "Only count clicks of this recent period, e.g. 30m, 24h or 7d (at most 31d). Adds click_count, click_through_count and ctr totals for the period, and a ctr per top product. The period is counted in whole minute, hour or day buckets, the current one included. This click history is only kept in memory, so it starts empty again whenever the server restarts"
     responses:
       200:
         description: Top metrics retrieved successfully
@@ -689,6 +869,8 @@ def get_metrics(current_user):
               "top_products_clicks": [{"id": "67890", "name": "Product B", "click_count": 120}],
               "top_products_clickthroughs": [{"id": "54321", "name": "Product C", "click_through_count": 100}]
             }
+      400:
+        description: Invalid window
       403:
         description: Unauthorized access for non-admin users
         content:
@@ -700,55 +882,27 @@ def get_metrics(current_user):
     if not current_user["is_admin"]:
         return jsonify({"error": "Only admin users can access metrics."}), 403
 
-    # Top brands followed by users
-    brand_follow_counts = {}
-    for user_data in users.values():
-        followed_brands = user_data.get('followed_brand', [])
-        if followed_brands:
-            for brand_id in followed_brands:
-                brand = brands.get(brand_id, {})
-                brand_name = brand.get("name", "Unknown Brand")
-                brand_follow_counts[brand_id] = {
-                    "id": brand_id,
-                    "name": brand_name,
-                    "count": brand_follow_counts.get(brand_id, {}).get("count", 0) + 1
-                }
-    top_brands_followed = sorted(
-        brand_follow_counts.values(),
-        key=lambda x: x["count"], reverse=True
-    )[:20]
-
-    # Top items wishlisted by users
-    wish_count = {}
-    for user_data in users.values():
-        wish_list = user_data.get('wish_list', [])
-        if wish_list:
-            for product_id in wish_list:
-                product = products.get(product_id, {})
-                product_name = product.get("name", "Unknown Product")
-                wish_count[product_id] = {
-                    "id": product_id,
-                    "name": product_name,
-                    "count": wish_count.get(product_id, {}).get("count", 0) + 1
-                }
-    top_items_wishlisted = sorted(
-        wish_count.values(),
-        key=lambda x: x["count"], reverse=True
-    )[:20]
-
-    # Top products by clicks
-    top_products_clicks = sorted(
-        [{"id": pid, "name": pdata.get("name", "Unknown Product"), "click_count": pdata.get("click_count", 0)}
-         for pid, pdata in products.items() if pdata and pdata.get("click_count", 0) > 0],
-        key=lambda x: x["click_count"], reverse=True
-    )[:20]
-
-    # Top products by clickthroughs
-    top_products_clickthroughs = sorted(
-        [{"id": pid, "name": pdata.get("name", "Unknown Product"), "click_through_count": pdata.get("click_through_count", 0)}
-         for pid, pdata in products.items() if pdata and pdata.get("click_through_count", 0) > 0],
-        key=lambda x: x["click_through_count"], reverse=True
-    )[:20]
+    window = request.args.get("window")
+    if window is not None:
+        try:
+            window_seconds = parse_window(window)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+
+    click_counters.merge()  # Include the clicks not merged into products yet
+
+    top = metrics_index.top(20)
+
+    def named(entries, collection, fallback, count_field):
+        return [
+            {"id": key, "name": collection.get(key, {}).get("name", fallback), count_field: count}
+            for key, count in entries
+        ]
+
+    top_brands_followed = named(top["followers"], brands, "Unknown Brand", "count")
+    top_items_wishlisted = named(top["wishlisters"], products, "Unknown Product", "count")
+    top_products_clicks = named(top["clicks"], products, "Unknown Product", "click_count")
+    top_products_clickthroughs = named(top["click_throughs"], products, "Unknown Product", "click_through_count")
 
     # Construct the response
     response = {
@@ -757,19 +911,47 @@ def get_metrics(current_user):
         "top_products_clicks": top_products_clicks,
         "top_products_clickthroughs": top_products_clickthroughs
     }
+    if window is not None:
+        response.update(click_history.window(window_seconds))
+        response["window"] = window
 
     return jsonify(response), 200
 
 
+@app.route("/admin/cache/stats", methods=["GET"])
+@token_required(users)
+def get_cache_stats(current_user):
+    """
+    Get query cache statistics (Admin only)
+    ---
+    tags:
+      - Metrics
+    responses:
+      200:
+        description: Entries, bytes, hits, misses, evictions and hit rate of the /products query cache
+      403:
+        description: Unauthorized
+    security:
+      - Bearer: []
+    """
+    if not current_user["is_admin"]:
+        return jsonify({"error": "Only admin users can access cache statistics."}), 403
+
+    return jsonify({"products": query_cache.stats()}), 200
+
+
 @app.route("/")
 def index():
     return redirect("/apidocs")
 
 
-# Save and load the database on server startup
+# Data is loaded when the module is imported; start the server
 if __name__ == "__main__":
-    load_data(users, brands, products)
+    # Turn SIGTERM (docker stop) into a normal exit so pending writes and clicks are flushed.
+    # Without the reloader this is the serving process itself; the reloader's parent would
+    # get the signal instead and its serving child would be killed without flushing.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     notification_thread = threading.Thread(target=schedule_periodic_notifications, args=(app,))
     notification_thread.daemon = True
     notification_thread.start()
-    app.run(debug=True, host="0.0.0.0", port=9900)
+    app.run(debug=True, use_reloader=DEV_RELOADER, host="0.0.0.0", port=9900)
@@ -1,7 +1,73 @@
-from flask import request, jsonify
-from helper import save_data, generateId, token_required
+import itertools
+import threading
+from flask import request, jsonify, send_from_directory
+from helper import (
+    save_data,
+    generateId,
+    token_required,
+    store_logo,
+    get_query_list,
+    encode_cursor,
+    decode_cursor,
+    data_validators,
+    not_modified,
+    set_validators,
+    LOGO_FOLDER,
+    STREAM_MIN_ITEMS,
+)
+from streaming import stream_list, wants_ndjson
 import base64
 
+DESCRIPTION_SNIPPET_LENGTH = 120
+
+
+class BrandSummaries:
+    """
+    Precomputed /brands listing entries, kept in the same order as `brands`.
+    Call refresh(brand_id) whenever a brand changes, or refresh() to rebuild everything.
+    """
+
+    def __init__(self, brands):
+        self.brands = brands
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self.refresh()
+
+    def refresh(self, brand_id=None):
+        with self._lock:
+            if brand_id is None:
+                self._summaries = {bid: self._summarize(brand) for bid, brand in self.brands.items()}
+            elif brand_id in self.brands:
+                self._summaries[brand_id] = self._summarize(self.brands[brand_id])
+            else:
+                self._summaries.pop(brand_id, None)
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def page(self, offset, limit=None):
+        """
+        Up to `limit` summaries starting at `offset`, as (brand_id, summary)
+        pairs, and the number of brands.
+        """
+        stop = None if limit is None else offset + limit
+        with self._lock:
+            return list(itertools.islice(self._summaries.items(), offset, stop)), len(self._summaries)
+
+    @staticmethod
+    def _summarize(brand):
+        description = brand.get("description", "")
+        if len(description) > DESCRIPTION_SNIPPET_LENGTH:
+            description = description[:DESCRIPTION_SNIPPET_LENGTH].rstrip() + "..."
+        return {
+            "brand_id": brand["brand_id"],
+            "name": brand["name"],
+            "description_snippet": description,
+            "logo_url": brand.get("logo_url"),
+            "product_count": len(brand.get("product_list", [])),
+            "followers_count": len(brand.get("followers_list", [])),
+        }
+
 
 def add_brand(users, products, brands):
     @token_required(users)
@@ -50,7 +116,7 @@ def add_brand(users, products, brands):
             return jsonify({"error": "Missing required fields"}), 400
 
         try:
-            base64.b64decode(data["logo"], validate=True)
+            logo_fields = store_logo(data["logo"])
         except base64.binascii.Error:
             return jsonify({"error": "Invalid logo format. Expected base64 encoded image data."}), 400
 
@@ -61,12 +127,13 @@ def add_brand(users, products, brands):
             "brand_id": brand_id,
             "name": data["name"],
             "description": data["description"],
-            "logo": data["logo"],
+            "logo_hash": logo_fields["logo_hash"],
+            "logo_url": logo_fields["logo_url"],
             "product_list": [],
             "followers_list": [],
         }
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("brands", brand_id)])
         return jsonify({"message": "Brand added successfully", "brand_id": brand_id}), 200
 
     return add_brand_route
@@ -109,7 +176,7 @@ def delete_brand(users, products, brands):
                 return jsonify({"error": "Cannot delete brand; it is associated with existing products"}), 400
 
         del brands[brand_id]
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("brands", brand_id)])
         return jsonify({"message": "Brand deleted successfully"}), 200
 
     return delete_brand_route
@@ -173,33 +240,136 @@ def edit_brand(users, products, brands):
 
         if "logo" in data:
             try:
-                base64.b64decode(data["logo"], validate=True)
-                brands[brand_id]["logo"] = data["logo"]
+                brands[brand_id].update(store_logo(data["logo"]))
             except base64.binascii.Error:
                 return jsonify({"error": "Invalid logo format. Expected base64 encoded image data."}), 400
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("brands", brand_id)])
         return jsonify({"message": "Brand updated successfully"}), 200
 
     return edit_brand_route
 
 
-def get_all_brands(brands):
+def get_all_brands(brands, brand_summaries):
     def get_all_brands_route():
         """
-        Get all brands (Admin and User)
+        Get a summary of all brands (Admin and User)
         ---
         tags:
           - Brands
+        parameters:
+          - name: fields
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+            description: "Extra brand fields to include (e.g., description, product_list, followers_list)"
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: "Maximum number of brands to return"
+          - name: cursor
+            in: query
+            type: string
+            required: false
+            description: "The next_cursor value of the previous page"
         responses:
           200:
-            description: Returns a list of all brands
+            description: "Returns brand_id, name, description_snippet, logo_url, product_count and followers_count per brand. Sent as newline-delimited JSON, with total and next_cursor in the X-Total and X-Next-Cursor headers, when the Accept header asks for application/x-ndjson"
+          304:
+            description: The brands have not changed since the version given in If-None-Match or If-Modified-Since
+          400:
+            description: Invalid limit or cursor
         """
-        return jsonify({"brands": list(brands.values())}), 200
+        ndjson = wants_ndjson()
+        etag, last_modified = data_validators("brands", representation="ndjson" if ndjson else None)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+
+        fields = get_query_list("fields")
+        limit = request.args.get("limit", type=int)
+        cursor = request.args.get("cursor")
+
+        if limit is not None and limit < 0:
+            return jsonify({"error": "limit must not be negative"}), 400
+        try:
+            offset = decode_cursor(cursor) if cursor else 0
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+        page, total = brand_summaries.page(offset, limit)
+        if fields:
+            page = [
+                (brand_id, {
+                    **summary,
+                    **{field: brands[brand_id][field] for field in fields if field in brands.get(brand_id, {})},
+                })
+                for brand_id, summary in page
+            ]
+
+        next_offset = offset + len(page)
+        envelope = {
+            "total": total,
+            "next_cursor": encode_cursor(next_offset) if next_offset < total else None,
+        }
+        if ndjson or len(page) > STREAM_MIN_ITEMS:
+            response = stream_list((summary for _, summary in page), envelope, "brands", ndjson)
+        else:
+            response = jsonify({"brands": [summary for _, summary in page], **envelope})
+        return set_validators(response, etag, last_modified), 200
 
     return get_all_brands_route
 
 
+def get_brand_logo():
+    def get_brand_logo_route(filename):
+        """
+        Get a brand logo by its content hash (Admin and User)
+        ---
+        tags:
+          - Brands
+        parameters:
+          - name: filename
+            in: path
+            type: string
+            required: true
+            description: "The logo file name from the brand's logo_url, e.g. <sha256>.png"
+        responses:
+          200:
+            description: Returns the logo image
+          404:
+            description: Logo not found
+        """
+        # Logos are addressed by content hash, so a URL never changes meaning
+        response = send_from_directory(LOGO_FOLDER, filename, max_age=31536000)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    return get_brand_logo_route
+
+
+def migrate_brand_logos(users, brands, products):
+    """
+    Move base64 logos still embedded in brand records into the logo store.
+    """
+    changes = []
+    for brand_id, brand in brands.items():
+        if "logo" not in brand:
+            continue
+        try:
+            brand.update(store_logo(brand["logo"]))
+        except base64.binascii.Error:
+            continue
+        del brand["logo"]
+        changes.append(("brands", brand_id))
+
+    if changes:
+        save_data(users, brands, products, changes, durability="sync")
+
+
 def get_single_brand(brands):
     def get_single_brand_route(brand_id):
         """
@@ -216,14 +386,20 @@ def get_single_brand(brands):
         responses:
           200:
             description: Returns a single brand
+          304:
+            description: The brand has not changed since the version given in If-None-Match or If-Modified-Since
           404:
             description: Brand not found
         """
         if brand_id not in brands:
             return jsonify({"error": "Brand not found"}), 404
+        etag, last_modified = data_validators("brands", brand_id)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged is not None:
+            return unchanged
         brand_data = brands[brand_id]
         brand_data["followers_count"] = len(brand_data.get("followers_list", []))
-        return jsonify(brand_data), 200
+        return set_validators(jsonify(brand_data), etag, last_modified), 200
 
     return get_single_brand_route
 
@@ -268,7 +444,7 @@ def follow_brand(users, products, brands):
         if current_user["user_id"] not in brand.get("followers_list", []):
             brand.setdefault("followers_list", []).append(current_user["user_id"])
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", current_user["email"]), ("brands", brand_id)])
         return jsonify({"message": f'You are now following {brand["name"]}'}), 200
 
     return follow_brand_route
@@ -314,7 +490,7 @@ def unfollow_brand(users, products, brands):
         if current_user["user_id"] in brand.get("followers_list", []):
             brand["followers_list"].remove(current_user["user_id"])
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", current_user["email"]), ("brands", brand_id)])
         return jsonify({"message": f'You have unfollowed {brand["name"]}'}), 200
 
     return unfollow_brand_route
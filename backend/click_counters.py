@@ -0,0 +1,110 @@
+import datetime
+import math
+import threading
+import time
+
+COUNTER_FIELDS = ("click_count", "click_through_count")
+# Event types accepted by /products/events:batch and the counter each one increments
+EVENT_TYPES = {"click": "click_count", "clickthrough": "click_through_count"}
+
+
+def parse_event_time(value):
+    """
+    Epoch seconds of an event timestamp given as epoch seconds or an ISO 8601
+    string; the current time if it is missing. Raises ValueError otherwise,
+    including for NaN and infinite numbers.
+    """
+    if value is None:
+        return time.time()
+    if isinstance(value, bool):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise ValueError("Invalid timestamp")
+        return float(value)
+    if isinstance(value, str):
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return moment.timestamp()
+    raise ValueError("Invalid timestamp")
+
+
+class ClickCounters:
+    """
+    In-memory accumulators for product click and click-through counts.
+
+    Counting a click only takes one of `stripes` locks, picked by product id,
+    so concurrent requests rarely wait on each other. Every `interval` seconds
+    a background thread merges the accumulated counts into `products` and
+    hands all the changed product ids to `save(product_ids)` at once, so a
+    batch of clicks costs one persistence step and one catalog refresh.
+    """
+
+    def __init__(self, products, save, interval=1.0, stripes=16):
+        self.products = products
+        self.save = save
+        self.interval = interval
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]  # product_id -> [clicks, click-throughs]
+        self._merge_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add(self, product_id, field, amount=1):
+        """
+        Count `amount` events of `field` ("click_count" or "click_through_count").
+        """
+        index = COUNTER_FIELDS.index(field)
+        lock, counts = self._stripes[hash(product_id) % len(self._stripes)]
+        with lock:
+            counter = counts.get(product_id)
+            if counter is None:
+                counter = counts[product_id] = [0, 0]
+            counter[index] += amount
+        if self._thread is None:
+            self._ensure_thread()
+
+    def merge(self):
+        """
+        Add everything counted so far to `products` and save the changed products.
+        Returns the merged product ids.
+        """
+        with self._merge_lock:
+            pending = {}
+            for lock, counts in self._stripes:
+                with lock:
+                    pending.update(counts)  # Each product id lives in a single stripe
+                    counts.clear()
+
+            merged = []
+            for product_id, counter in pending.items():
+                product = self.products.get(product_id)
+                if product is None:
+                    continue  # Deleted since it was clicked
+                for field, amount in zip(COUNTER_FIELDS, counter):
+                    if amount:
+                        product[field] = product.get(field, 0) + amount
+                merged.append(product_id)
+            if merged:
+                self.save(merged)
+            return merged
+
+    def close(self):
+        """
+        Stop the background thread and merge what is left. Called on shutdown.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.merge()
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="click-counter-merger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.merge()
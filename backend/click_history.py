@@ -0,0 +1,153 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+
+# (bucket width in seconds, buckets kept) per resolution, finest first
+RESOLUTIONS = ((60, 60), (3600, 48), (86400, 31))
+# Longest window that can be queried
+MAX_WINDOW = RESOLUTIONS[-1][0] * RESOLUTIONS[-1][1]
+
+_WINDOW = re.compile(r"^(\d+)([mhd])$")
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(value):
+    """
+    Seconds in a window like "30m", "24h" or "7d". Raises ValueError if it is
+    malformed or longer than MAX_WINDOW.
+    """
+    match = _WINDOW.match(value or "")
+    if not match:
+        raise ValueError("Window must look like 30m, 24h or 7d")
+    seconds = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    if not 0 < seconds <= MAX_WINDOW:
+        raise ValueError(f"Window must be between 1m and {MAX_WINDOW // 86400}d")
+    return seconds
+
+
+class _Ring:
+    """
+    Fixed number of time buckets of one width, reused in a circle. Each slot
+    holds a click and a click-through count, and remembers which bucket it
+    currently counts so stale slots are reset when they come round again.
+    """
+
+    __slots__ = ("width", "counts", "buckets")
+
+    def __init__(self, width, size):
+        self.width = width
+        self.counts = array("I", [0]) * (2 * size)
+        self.buckets = array("i", [-1]) * size
+
+    def add(self, timestamp, index, amount):
+        bucket = int(timestamp // self.width)
+        slot = bucket % len(self.buckets)
+        if self.buckets[slot] != bucket:
+            if self.buckets[slot] > bucket:
+                return  # Older than anything this ring still keeps
+            self.buckets[slot] = bucket
+            self.counts[2 * slot] = self.counts[2 * slot + 1] = 0
+        self.counts[2 * slot + index] += amount
+
+    def total(self, start, now):
+        """
+        (clicks, click-throughs) in the buckets starting within [start, now].
+        A bucket only partly inside the window is left out at the old end, so a
+        window of N bucket widths reads N buckets, the current one included.
+        """
+        first, last = -int(-start // self.width), int(now // self.width)
+        clicks = click_throughs = 0
+        for slot, bucket in enumerate(self.buckets):
+            if first <= bucket <= last:
+                clicks += self.counts[2 * slot]
+                click_throughs += self.counts[2 * slot + 1]
+        return clicks, click_throughs
+
+
+class ClickHistory:
+    """
+    Per-product click and click-through counts over time, for windowed
+    analytics such as the most clicked products of the last 24 hours.
+
+    Each product gets a ring of minute, hour and day buckets (RESOLUTIONS).
+    Every event is counted in all three, and a query reads the finest
+    resolution that covers its window, in whole buckets. The rings have a
+    fixed size, so memory depends on the number of products and never on the
+    traffic. Events older than a ring's span simply fall out of it. Nothing is
+    persisted, so the history starts empty on every restart.
+
+    Call refresh(product_id) when a product changes so deleted products are dropped.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self._lock = threading.Lock()
+        self._rings = {}  # product_id -> [_Ring per resolution]
+
+    def record(self, product_id, field, timestamp=None, amount=1):
+        """
+        Count `amount` events of `field` ("click_count" or "click_through_count")
+        at `timestamp` (epoch seconds, default now).
+        """
+        now = time.time()
+        timestamp = now if timestamp is None else min(timestamp, now)
+        index = 0 if field == "click_count" else 1
+        with self._lock:
+            rings = self._rings.get(product_id)
+            if rings is None:
+                rings = self._rings[product_id] = [_Ring(width, size) for width, size in RESOLUTIONS]
+            for ring in rings:
+                ring.add(timestamp, index, amount)
+
+    def refresh(self, product_id=None):
+        with self._lock:
+            if product_id is None:
+                for stale in [pid for pid in self._rings if pid not in self.products]:
+                    del self._rings[stale]
+            elif product_id not in self.products:
+                self._rings.pop(product_id, None)
+
+    def window(self, seconds, limit=20):
+        """
+        Click statistics of the last `seconds`: overall totals and click-through
+        rate, and the `limit` products with the most clicks and click-throughs.
+        """
+        now = time.time()
+        start = now - seconds
+        level = next(
+            level for level, (width, size) in enumerate(RESOLUTIONS) if width * size >= seconds
+        )
+        with self._lock:
+            totals = {
+                product_id: rings[level].total(start, now) for product_id, rings in self._rings.items()
+            }
+
+        def entry(product_id):
+            clicks, click_throughs = totals[product_id]
+            product = self.products.get(product_id, {})
+            return {
+                "id": product_id,
+                "name": product.get("name", "Unknown Product"),
+                "click_count": clicks,
+                "click_through_count": click_throughs,
+                "ctr": click_throughs / clicks if clicks else 0.0,
+            }
+
+        clicked = [product_id for product_id, (clicks, _) in totals.items() if clicks]
+        clicked_through = [product_id for product_id, (_, click_throughs) in totals.items() if click_throughs]
+        click_count = sum(clicks for clicks, _ in totals.values())
+        click_through_count = sum(click_throughs for _, click_throughs in totals.values())
+        return {
+            "click_count": click_count,
+            "click_through_count": click_through_count,
+            "ctr": click_through_count / click_count if click_count else 0.0,
+            "top_products_clicks": [
+                entry(product_id) for product_id in heapq.nlargest(limit, clicked, key=lambda pid: totals[pid][0])
+            ],
+            "top_products_clickthroughs": [
+                entry(product_id)
+                for product_id in heapq.nlargest(limit, clicked_through, key=lambda pid: totals[pid][1])
+            ],
+        }
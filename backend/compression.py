@@ -0,0 +1,129 @@
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is always available
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional, gzip is always available
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "application/javascript")
+
+# Encoders in order of preference when the client accepts several equally
+ENCODERS = {}
+if brotli is not None:
+    ENCODERS["br"] = lambda data: brotli.compress(data, quality=5)
+if zstandard is not None:
+    ENCODERS["zstd"] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)  # Compressors are not thread-safe
+ENCODERS["gzip"] = lambda data: gzip.compress(data, compresslevel=6)
+
+# Incremental encoders for streamed responses, each returning (compress, finish) functions
+STREAM_ENCODERS = {}
+if brotli is not None:
+    def _brotli_stream():
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+
+    STREAM_ENCODERS["br"] = _brotli_stream
+if zstandard is not None:
+    def _zstd_stream():
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        return compressor.compress, compressor.flush
+
+    STREAM_ENCODERS["zstd"] = _zstd_stream
+
+
+def _gzip_stream():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    return compressor.compress, compressor.flush
+
+
+STREAM_ENCODERS["gzip"] = _gzip_stream
+
+
+def choose_encoding(accept_encodings):
+    """
+    The preferred encoding of ENCODERS the client accepts, or None.
+    """
+    best, best_quality = None, 0
+    for encoding in ENCODERS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def init_compression(app, min_bytes=1024):
+    """
+    Compress JSON and text responses of at least `min_bytes` with the best
+    encoding the client accepts.
+
+    A route can set `response.compressed_variants` to a dict kept with a cached
+    body (see QueryCache); each encoding of that body is then compressed once
+    and reused by every later response built from the same cache entry.
+
+    Streamed responses are compressed chunk by chunk as they are sent.
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.direct_passthrough:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES and not response.mimetype.startswith("text/"):
+            return response
+        response.vary.add("Accept-Encoding")
+        if "Content-Encoding" in response.headers:
+            return response
+
+        if response.is_streamed:
+            encoding = choose_encoding(request.accept_encodings)
+            if encoding is not None:
+                response.response = _compress_stream(response.response, STREAM_ENCODERS[encoding]())
+                response.headers["Content-Encoding"] = encoding
+                _weaken_etag(response)
+            return response
+
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        variants = getattr(response, "compressed_variants", None)
+        data = variants.get(encoding) if variants is not None else None
+        if data is None:
+            data = ENCODERS[encoding](body)
+            if variants is not None:
+                variants[encoding] = data
+        if len(data) >= len(body):
+            return response
+
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        _weaken_etag(response)
+        return response
+
+    return compress_response
+
+
+def _weaken_etag(response):
+    # The compressed bytes differ, but they represent the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def _compress_stream(chunks, encoder):
+    compress, finish = encoder
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
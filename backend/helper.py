@@ -1,20 +1,71 @@
 import os
 import json
+import atexit
 import datetime
 import base64
+import hashlib
+import threading
+import time
 from functools import wraps
 from flask import jsonify, request
 from flask_mail import Mail, Message
 from flask import current_app
 import jwt
+from storage import JsonStorage, SqliteStorage, ShardedJsonStorage
+from persistence import FlushScheduler
 
 JWT_SECRET = 'giraffegiraffebeetroot'
 DATABASE_FILE = '/app/backend/database.json'
+SQLITE_DATABASE_FILE = '/app/backend/database.db'
+SHARDED_DATA_DIR = '/app/backend/data'
+SHARD_COUNTS = {"users": 4, "brands": 1, "products": 16}
+STORAGE_BACKEND = os.environ.get("NUOVO_STORAGE", "json")  # "json", "sharded" or "sqlite"
 CATEGORIES_FILE = "/app/backend/categories_new.json"
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+LOGO_FOLDER = '/app/backend/static/brand_logos'
+LOGO_URL_PREFIX = '/api/brands/logos/'
+WAL_COMPACT_THRESHOLD = 1000  # Log records written before folding them into a new snapshot
+PERSIST_DURABILITY = os.environ.get("NUOVO_DURABILITY", "group")  # "sync", "group" or "async"
+FLUSH_INTERVAL_MS = int(os.environ.get("NUOVO_FLUSH_INTERVAL_MS", 20))
+FLUSH_MAX_PENDING = int(os.environ.get("NUOVO_FLUSH_MAX_PENDING", 500))
+QUERY_CACHE_MAX_MB = int(os.environ.get("NUOVO_QUERY_CACHE_MB", 32))
+QUERY_CACHE_TTL = int(os.environ.get("NUOVO_QUERY_CACHE_TTL", 60))  # Seconds
+COMPRESS_MIN_BYTES = int(os.environ.get("NUOVO_COMPRESS_MIN_BYTES", 1024))
+CLICK_MERGE_INTERVAL_MS = int(os.environ.get("NUOVO_CLICK_MERGE_MS", 1000))
+MAX_EVENT_BATCH = 1000  # Events accepted by one /products/events:batch request
+STREAM_MIN_ITEMS = 1000  # List responses with more items are streamed rather than built (and cached) in memory
+COLUMNAR_PRODUCTS = os.environ.get("NUOVO_COLUMNAR", "1") != "0"  # Only takes effect when numpy is installed
+DEV_RELOADER = os.environ.get("NUOVO_RELOAD", "0") == "1"  # Restart on code changes, development only
 
 mail = None  # Placeholder for the Mail instance
 _blacklist = None  # This will be initialized from app.py
+_change_listeners = {"users": [], "brands": [], "products": []}
+# Version counters and last change times behind ETag / Last-Modified, bumped by save_data
+_BOOT_ID = format(int(time.time() * 1000), "x")  # ETags issued before a restart never match
+_BOOT_TIME = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+_versions = {}  # collection or (collection, key) -> (version, last changed)
+_snapshot_version = (0, _BOOT_TIME)
+_versions_lock = threading.Lock()
+
+
+def open_storage(backend):
+    """
+    Create the storage backend named by NUOVO_STORAGE.
+    The SQLite and sharded backends import DATABASE_FILE the first time they start empty.
+    """
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_DATABASE_FILE, seed_path=DATABASE_FILE)
+    if backend == "sharded":
+        return ShardedJsonStorage(SHARDED_DATA_DIR, SHARD_COUNTS, seed_path=DATABASE_FILE)
+    if backend == "json":
+        return JsonStorage(DATABASE_FILE, WAL_COMPACT_THRESHOLD)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+_storage = open_storage(STORAGE_BACKEND)
+_scheduler = FlushScheduler(_storage, PERSIST_DURABILITY, FLUSH_INTERVAL_MS / 1000, FLUSH_MAX_PENDING)
+atexit.register(_scheduler.close)  # Flush pending writes on graceful shutdown
+
 
 def allowed_file(filename):
     """
@@ -22,6 +73,36 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_logo(logo_base64):
+    """
+    Write a base64 encoded logo to the content-addressed logo store.
+    Returns the logo_hash/logo_url fields to keep on the brand record.
+    Raises binascii.Error if the data is not valid base64.
+    """
+    data = base64.b64decode(logo_base64, validate=True)
+    logo_hash = hashlib.sha256(data).hexdigest()
+
+    if data.startswith(b"\x89PNG"):
+        extension = "png"
+    elif data.startswith(b"GIF8"):
+        extension = "gif"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        extension = "webp"
+    else:
+        extension = "jpg"
+
+    filename = f"{logo_hash}.{extension}"
+    filepath = os.path.join(LOGO_FOLDER, filename)
+    if not os.path.exists(filepath):
+        os.makedirs(LOGO_FOLDER, exist_ok=True)
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, filepath)
+
+    return {"logo_hash": logo_hash, "logo_url": LOGO_URL_PREFIX + filename}
+
+
 def initialize_blacklist(blacklist):
     """
     Initialize the blacklist to be used for token validation.
@@ -32,23 +113,115 @@ def initialize_blacklist(blacklist):
 # Helper functions
 def load_data(users, brands, products):
     """
-    Load data from the database file into the provided dictionaries.
+    Load data from the database snapshot and write-ahead log into the provided dictionaries.
     """
-    if os.path.exists(DATABASE_FILE):
-        with open(DATABASE_FILE, "r") as file:
-            data = json.load(file)
-            users.update(data.get("users", {}))
-            brands.update(data.get("brands", {}))
-            products.update(data.get("products", {}))
-    else:
+    stores = {"users": users, "brands": brands, "products": products}
+    if not _storage.load(stores):
         save_data(users, brands, products)  # Initialize and save empty data if file doesn't exist
+    else:
+        _scheduler.track(stores)
+
+
+def save_data(users, brands, products, changes=None, durability=None):
+    """
+    Persist the given dictionaries.
+    `changes` lists the (collection, key) pairs touched by the caller, e.g. [("products", product_id)],
+    which are appended to the write-ahead log. Without it a full snapshot is written.
+    `durability` overrides PERSIST_DURABILITY for this call ("sync", "group" or "async").
+    """
+    if changes is None:
+        for listeners in _change_listeners.values():
+            for listener, _ in listeners:
+                listener(None)
+    else:
+        changed_keys = {}
+        for collection, key in dict.fromkeys(changes):
+            changed_keys.setdefault(collection, []).append(key)
+        for collection, keys in changed_keys.items():
+            for listener, batch in _change_listeners[collection]:
+                if batch:
+                    listener(keys)
+                else:
+                    for key in keys:
+                        listener(key)
+    # After the listeners, so a new ETag is never paired with stale derived data
+    _bump_versions(changes)
+
+    stores = {"users": users, "brands": brands, "products": products}
+    _scheduler.submit(stores, changes, durability)
+
+
+def _bump_versions(changes):
+    global _snapshot_version
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with _versions_lock:
+        if changes is None:
+            _versions.clear()
+            _snapshot_version = (_snapshot_version[0] + 1, now)
+            return
+        for target in dict.fromkeys(list(changes) + [collection for collection, _ in changes]):
+            _versions[target] = (_versions.get(target, (0,))[0] + 1, now)
 
 
-def save_data(users, brands, products):
-    with open(DATABASE_FILE, "w") as file:
-        json.dump(
-            {"users": users, "brands": brands, "products": products}, file, indent=2
+def data_validators(collection, key=None, representation=None):
+    """
+    The ETag and Last-Modified time of a whole collection, or of `key` in it,
+    for conditional GET handling. Both change whenever save_data is told about a
+    change to it, and on restart. `representation` (e.g. "ndjson") tells apart
+    ETags of other formats of the same data.
+    """
+    target = collection if key is None else (collection, key)
+    with _versions_lock:
+        version, changed = _versions.get(target, (0, _BOOT_TIME))
+        snapshot, snapshot_changed = _snapshot_version
+    etag = f"{_BOOT_ID}-{snapshot}-{version}"
+    if representation:
+        etag += f"-{representation}"
+    return etag, max(changed, snapshot_changed)
+
+
+def not_modified(etag, last_modified):
+    """
+    Return a 304 response if the request's If-None-Match (or, without one,
+    If-Modified-Since) shows the client already has this version, else None.
+    """
+    if request.if_none_match:
+        # Weak comparison, compressed responses carry the weak form of the ETag
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = (
+            request.if_modified_since is not None
+            and last_modified.replace(microsecond=0) <= request.if_modified_since
         )
+    if not fresh:
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    """
+    Set the ETag and Last-Modified headers. Last-Modified only has whole
+    seconds, so it is left out until the second of the last change is over:
+    a later change in that second would otherwise carry the same date and
+    If-Modified-Since would answer 304 to a client that never saw it.
+    """
+    response.set_etag(etag)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if last_modified.replace(microsecond=0) + datetime.timedelta(seconds=1) <= now:
+        response.last_modified = last_modified
+    else:
+        response.headers.pop("Last-Modified", None)
+    return response
+
+
+def register_change_listener(collection, listener, batch=False):
+    """
+    Register `listener(key)` to be called whenever save_data is told that `key` in `collection`
+    ("users", "brands" or "products") changed. A full snapshot calls `listener(None)`.
+    With `batch`, the listener is called once per save_data with the list of changed keys instead.
+    Used to keep derived views of the stores up to date.
+    """
+    _change_listeners[collection].append((listener, batch))
 
 
 def load_categories():
@@ -113,6 +286,26 @@ def get_query_list(param_name):
     return []
 
 
+def encode_cursor(offset):
+    """
+    Encode a list position as an opaque pagination cursor.
+    """
+    return base64.urlsafe_b64encode(str(offset).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        offset = int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (UnicodeError, base64.binascii.Error):
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
 def initialize_mail(app_mail):
     """
     Initializes the Mail instance to be used for sending emails.
@@ -139,6 +332,7 @@ def send_periodic_notifications(users, brands, products):
     Sends notifications to users based on followed brands, subcategories, and wishlist items.
     """
     with current_app.app_context():  # Push the application context
+        notified = []
         for email, user in users.items():
             if user.get("is_admin"):
                 continue
@@ -185,6 +379,7 @@ def send_periodic_notifications(users, brands, products):
                     "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
                 }
                 user["notifications"].append(notification)
+                notified.append(("users", email))
 
         # Save data after processing notifications
-        save_data(users, brands, products)
+        save_data(users, brands, products, notified)
@@ -0,0 +1,113 @@
+import bisect
+import threading
+from collections import Counter
+
+
+class TopCounts:
+    """
+    Counts per key, kept in a list sorted by count (highest first) so the top K
+    are read off its head instead of sorting every key. Equal counts keep the
+    order in which their keys were first counted.
+    """
+
+    def __init__(self):
+        self._counts = {}  # key -> (count, sequence number)
+        self._ordered = []  # Sorted (-count, sequence number, key), only for positive counts
+        self._next = 0
+
+    def add(self, key, delta):
+        if delta:
+            self.set(key, self._counts.get(key, (0, None))[0] + delta)
+
+    def set(self, key, count):
+        old, sequence = self._counts.get(key, (0, None))
+        if count == old:
+            return
+        if old > 0:
+            del self._ordered[bisect.bisect_left(self._ordered, (-old, sequence))]
+        if count > 0:
+            if sequence is None:
+                sequence, self._next = self._next, self._next + 1
+            self._counts[key] = (count, sequence)
+            bisect.insort(self._ordered, (-count, sequence, key))
+        else:
+            self._counts.pop(key, None)
+
+    def top(self, limit):
+        """
+        The `limit` (key, count) pairs with the highest counts.
+        """
+        return [(key, -negative) for negative, _, key in self._ordered[:limit]]
+
+
+class MetricsIndex:
+    """
+    Incrementally maintained counts behind /admin/metrics: followers per brand
+    and wishlisters per product (from the users' followed_brand and wish_list)
+    and clicks and click-throughs per product.
+
+    Call refresh_user(key) / refresh_product(product_id) whenever a user or
+    product changes, or pass None to rebuild. Each refresh only applies the
+    difference to what was counted for that user or product before.
+    """
+
+    def __init__(self, users, products):
+        self.users = users
+        self.products = products
+        self._lock = threading.Lock()
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self.followers = TopCounts()
+            self.wishlisters = TopCounts()
+            self.clicks = TopCounts()
+            self.click_throughs = TopCounts()
+            self._user_counts = {}  # user key -> (Counter of followed brands, Counter of wishlisted products)
+            for key in list(self.users):
+                self._refresh_user(key)
+            for product_id in list(self.products):
+                self._refresh_product(product_id)
+
+    def refresh_user(self, key=None):
+        if key is None:
+            self.rebuild()
+            return
+        with self._lock:
+            self._refresh_user(key)
+
+    def refresh_product(self, product_id=None):
+        if product_id is None:
+            self.rebuild()
+            return
+        with self._lock:
+            self._refresh_product(product_id)
+
+    def top(self, limit):
+        """
+        The `limit` highest (key, count) pairs of every count, by metric name.
+        """
+        with self._lock:
+            return {
+                "followers": self.followers.top(limit),
+                "wishlisters": self.wishlisters.top(limit),
+                "clicks": self.clicks.top(limit),
+                "click_throughs": self.click_throughs.top(limit),
+            }
+
+    def _refresh_user(self, key):
+        old_followed, old_wished = self._user_counts.pop(key, (Counter(), Counter()))
+        user = self.users.get(key)
+        followed = Counter(user.get("followed_brand") or []) if user else Counter()
+        wished = Counter(user.get("wish_list") or []) if user else Counter()
+        for brand_id in old_followed.keys() | followed.keys():
+            self.followers.add(brand_id, followed[brand_id] - old_followed[brand_id])
+        for product_id in old_wished.keys() | wished.keys():
+            self.wishlisters.add(product_id, wished[product_id] - old_wished[product_id])
+        if user:
+            self._user_counts[key] = (followed, wished)
+
+    def _refresh_product(self, product_id):
+        product = self.products.get(product_id) or {}
+        self.clicks.set(product_id, product.get("click_count", 0))
+        self.click_throughs.set(product_id, product.get("click_through_count", 0))
@@ -0,0 +1,201 @@
+import copy
+import logging
+import threading
+import time
+
+DURABILITY_LEVELS = ("sync", "group", "async")
+
+logger = logging.getLogger(__name__)
+
+_DELETED = object()  # Marks a dirty key that is no longer in its store
+RETRY_SECONDS = 1.0  # Pause before writing again after a failed write
+
+
+class PersistenceError(Exception):
+    """
+    Raised to "sync" and "group" writers whose changes could not be written.
+    The changes stay queued and are retried with the next batch.
+    """
+
+
+class _Batch:
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = False
+        self.error = None
+
+
+class FlushScheduler:
+    """
+    Coalesces save_data calls into batched writes made by a background thread.
+
+    Changed (collection, key) pairs are marked dirty together with a copy of
+    their current value, taken when they are submitted; the flusher writes the
+    latest copy of every dirty entity once per batch. A batch is written as
+    soon as a writer waits for it, so a lone request only pays for its own
+    write, and everything submitted while a write is in progress forms the
+    next batch. Changes nobody waits for are collected for up to `interval`
+    seconds, or until `max_pending` entities are dirty. Storage only ever sees
+    the scheduler's own copy of the stores, which request threads never mutate.
+    Durability levels:
+
+    - "sync":  write and fsync before returning
+    - "group": wait until the batch containing the change has been written, so
+               concurrent requests share a single write and fsync
+    - "async": return immediately and let the flusher write it later
+
+    A failed write is logged and its changes are queued again; "sync" and
+    "group" writers of that batch get a PersistenceError.
+    """
+
+    def __init__(self, storage, durability="group", interval=0.05, max_pending=500):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.storage = storage
+        self.durability = durability
+        self.interval = interval
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._mirror = None  # The flusher's copy of the stores, only touched under _flush_lock
+        self._dirty = {}  # (collection, key) -> copied value or _DELETED, in submission order
+        self._snapshot = None  # Copy of all stores when a full snapshot was requested
+        self._batch = _Batch()  # Outcome of the next write, shared by the writers waiting for it
+        self._waiters = 0  # "group" writers waiting for the next write
+        self._thread = None
+        self._closed = False
+
+    def track(self, stores):
+        """
+        Start from a copy of freshly loaded `stores`, before anything is submitted.
+        """
+        with self._flush_lock:
+            self._mirror = copy.deepcopy(stores)
+
+    def submit(self, stores, changes=None, durability=None):
+        """
+        Record a mutation of `stores`. `changes` is None for a full snapshot.
+        """
+        durability = durability or self.durability
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        if changes is not None and not changes:
+            return  # Nothing to write, and no batch would ever be written for a "group" writer
+
+
+        if self._mirror is None:
+            self.track(stores)
+        if changes is None:
+            snapshot, values = copy.deepcopy(stores), None
+        else:
+            snapshot = None
+            values = {
+                (collection, key): copy.deepcopy(stores[collection][key]) if key in stores[collection] else _DELETED
+                for collection, key in changes
+            }
+
+        with self._cond:
+            if snapshot is not None:
+                self._snapshot, self._dirty = snapshot, {}
+            else:
+                for change, value in values.items():
+                    self._dirty.pop(change, None)  # Keep submission order
+                    self._dirty[change] = value
+            batch = self._batch
+            if durability != "sync" and not self._closed:
+                self._ensure_thread()
+                self._cond.notify_all()
+                if durability == "group":
+                    self._waiters += 1
+                    try:
+                        while not batch.done and not self._closed:
+                            self._cond.wait()
+                    finally:
+                        self._waiters -= 1
+                    if batch.error is not None:
+                        raise PersistenceError("Changes could not be saved") from batch.error
+                return
+
+        self.flush()
+
+    def flush(self):
+        """
+        Write everything that is currently dirty. Raises PersistenceError if the
+        write fails, after queueing the changes again.
+        """
+        # Flushes are serialized so an older batch can never land after a newer one
+        with self._flush_lock:
+            with self._cond:
+                dirty, self._dirty = self._dirty, {}
+                snapshot, self._snapshot = self._snapshot, None
+                batch, self._batch = self._batch, _Batch()
+            try:
+                if snapshot is not None:
+                    self._mirror = snapshot
+                    self.storage.write_all(self._mirror)
+                if dirty:
+                    for (collection, key), value in dirty.items():
+                        store = self._mirror.setdefault(collection, {})
+                        if value is _DELETED:
+                            store.pop(key, None)
+                        else:
+                            store[key] = value
+                    self.storage.write(self._mirror, list(dirty), sync=True)
+            except Exception as error:
+                logger.exception("Writing %d changed records failed, they will be retried", len(dirty))
+                with self._cond:
+                    # Anything submitted since is newer than the failed values
+                    if self._snapshot is None:
+                        self._snapshot = snapshot
+                        self._dirty = {**dirty, **self._dirty}
+                    batch.error = error
+                raise PersistenceError("Changes could not be saved") from error
+            finally:
+                with self._cond:
+                    batch.done = True
+                    self._cond.notify_all()
+
+    def close(self):
+        """
+        Flush pending changes and stop the background thread. Called on shutdown.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+            self._thread.start()
+
+    def _pending(self):
+        return bool(self._dirty) or self._snapshot is not None
+
+    def _collecting(self):
+        return not self._waiters and len(self._dirty) < self.max_pending and self._snapshot is None
+
+    def _run(self):
+        failed = False
+        while True:
+            with self._cond:
+                while not self._closed and not self._pending():
+                    self._cond.wait()
+                # Write right away for waiting writers, otherwise give the batch `interval`
+                # seconds to fill up; after a failure give the storage time to recover
+                deadline = time.monotonic() + (RETRY_SECONDS if failed else self.interval)
+                while not self._closed and (failed or self._collecting()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+                failed = False
+            except PersistenceError:
+                failed = True
@@ -0,0 +1,156 @@
+try:
+    import numpy as np
+except ImportError:  # Optional, ProductIndex falls back to its set-based indexes
+    np = None
+
+
+def columns_available():
+    return np is not None
+
+
+class ProductColumns:
+    """
+    Columnar copy of the filterable product attributes, one row per product:
+    price, created-time epoch, wishlister count and catalog position as numeric
+    arrays, categorical codes for each indexed attribute, and a boolean
+    row x size matrix of in-stock sizes. Filters become vectorized boolean
+    masks and sorting becomes a lexsort over the matching rows, or with a
+    `limit` only over the rows that can reach the requested page.
+
+    Rows of deleted products are reused; the position column keeps results in
+    catalog order. Maintained by ProductIndex, which also holds its lock.
+    """
+
+    def __init__(self, attributes, capacity=1024):
+        self.attributes = attributes
+        self._rows = {}  # product_id -> row
+        self._ids = []  # row -> product_id
+        self._free = []
+        self._vocab = {attribute: {} for attribute in attributes}  # value -> code
+        self._size_columns = {}  # size label -> column in the size matrix
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._price = np.zeros(capacity)
+        self._created = np.zeros(capacity)
+        self._popularity = np.zeros(capacity, dtype=np.int64)
+        self._position = np.zeros(capacity, dtype=np.int64)
+        self._codes = {attribute: np.zeros(capacity, dtype=np.int32) for attribute in attributes}
+        self._sizes = np.zeros((capacity, 8), dtype=bool)
+
+    def upsert(self, product_id, entry, position, sizes):
+        """
+        Store the indexed `entry` of a product and its in-stock size labels.
+        """
+        row = self._rows.get(product_id)
+        if row is None:
+            row = self._free.pop() if self._free else self._append_row()
+            self._rows[product_id] = row
+            self._ids[row] = product_id
+
+        self._alive[row] = True
+        self._price[row] = entry["price"]
+        self._created[row] = entry["time_created"]
+        self._popularity[row] = entry["popularity"]
+        self._position[row] = position
+        for attribute in self.attributes:
+            vocab = self._vocab[attribute]
+            self._codes[attribute][row] = vocab.setdefault(entry[attribute], len(vocab))
+
+        self._sizes[row] = False
+        for size in sizes:
+            if size not in self._size_columns:
+                if len(self._size_columns) == self._sizes.shape[1]:
+                    self._sizes = np.hstack([self._sizes, np.zeros_like(self._sizes)])
+                self._size_columns[size] = len(self._size_columns)
+            self._sizes[row, self._size_columns[size]] = True
+
+    def remove(self, product_id):
+        row = self._rows.pop(product_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self._ids[row] = None
+            self._free.append(row)
+
+    def select(self, filters, match_values, sizes=None, min_price=None, max_price=None, sort=None,
+               descending=False, offset=0, limit=None, scores=None):
+        """
+        Same contract as ProductIndex.select. `match_values(attribute, values)`
+        returns the indexed values of `attribute` that the query values match.
+        """
+        used = len(self._ids)
+        mask = self._alive[:used].copy()
+        for attribute, values in filters.items():
+            if not values:
+                continue
+            vocab = self._vocab[attribute]
+            codes = [vocab[value] for value in match_values(attribute, values) if value in vocab]
+            if not codes:
+                return [], 0
+            mask &= np.isin(self._codes[attribute][:used], codes)
+        if min_price is not None:
+            mask &= self._price[:used] >= min_price
+        if max_price is not None:
+            mask &= self._price[:used] <= max_price
+        if sizes:
+            columns = [self._size_columns[size] for size in set(sizes) if size in self._size_columns]
+            if not columns:
+                return [], 0
+            mask &= self._sizes[:used, columns].any(axis=1)
+        if scores is not None:
+            scored = np.zeros(used, dtype=bool)
+            scored[[self._rows[product_id] for product_id in scores if product_id in self._rows]] = True
+            mask &= scored
+
+        rows = np.flatnonzero(mask)
+
+        if sort == "price":
+            primary = self._price[rows]
+        elif sort == "created":
+            primary = self._created[rows]
+        elif sort == "popularity":
+            primary, descending = self._popularity[rows], True
+        elif sort == "relevance":
+            relevance = (scores[self._ids[row]] for row in rows)
+            primary, descending = np.fromiter(relevance, dtype=float, count=len(rows)), True
+        else:
+            primary = None
+        if primary is not None and descending:
+            primary = -primary
+
+        total = len(rows)
+        stop = total if limit is None else min(offset + limit, total)
+        if offset >= stop:
+            return [], total
+        positions = self._position[rows]
+        bound = None if primary is None or stop == total else np.partition(primary, stop - 1)[stop - 1]
+        if bound is not None and not np.isnan(bound):  # NaN sorts last, such pages take the full sort
+            # Only sort the rows ahead of the last row of the page, plus those
+            # of the rows tied with it that come first
+            ahead = np.flatnonzero(primary < bound)
+            tied = np.flatnonzero(primary == bound)
+            needed = stop - len(ahead)
+            if needed < len(tied):
+                tied = tied[np.argpartition(positions[tied], needed - 1)[:needed]]
+            head = np.concatenate([ahead, tied])
+            rows, positions, primary = rows[head], positions[head], primary[head]
+        order = np.argsort(positions, kind="stable") if primary is None else np.lexsort((positions, primary))
+        return [self._ids[row] for row in rows[order[offset:stop]]], total
+
+    def _append_row(self):
+        row = len(self._ids)
+        if row == len(self._alive):
+            self._grow()
+        self._ids.append(None)
+        return row
+
+    def _grow(self):
+        def grown(array):
+            extra = np.zeros((len(array),) + array.shape[1:], dtype=array.dtype)
+            return np.concatenate([array, extra])
+
+        self._alive = grown(self._alive)
+        self._price = grown(self._price)
+        self._created = grown(self._created)
+        self._popularity = grown(self._popularity)
+        self._position = grown(self._position)
+        self._codes = {attribute: grown(codes) for attribute, codes in self._codes.items()}
+        self._sizes = grown(self._sizes)
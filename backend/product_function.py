@@ -1,9 +1,148 @@
 import os
 import datetime
-from flask import request, jsonify, send_from_directory
-from helper import save_data, generateId, token_required, allowed_file
-
-def get_products(products):
+import threading
+from flask import request, jsonify, send_from_directory, current_app
+from helper import (
+    save_data,
+    generateId,
+    token_required,
+    allowed_file,
+    encode_cursor,
+    decode_cursor,
+    data_validators,
+    not_modified,
+    set_validators,
+    STREAM_MIN_ITEMS,
+)
+from search_index import tokenize
+from suggest_index import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS
+from streaming import stream_list, wants_ndjson
+
+
+def product_summary(product):
+    """
+    The fields of a product shown in product listings.
+    """
+    return {
+        "product_id": product["product_id"],
+        "name": product["name"],
+        "price": float(product["price"]),
+        "previous_price": float(product["previous_price"]),
+        "main_category": product["main_category"],
+        "sub_category": product["sub_category"],
+        "brand": product["brand"],
+        "color": product["colour"],
+        "size": product["size"],
+        "first_image": (
+            product["picture_urls"][0] if product["picture_urls"] else None
+        ),
+        "time_created": product["time_created"],
+        "wishlister_count": len(set(product.get("wishlister_users", []))),
+        "product_url": product["product_url"],
+        "stock": product["stock"],
+        "status": product["status"],
+        "click_count": product["click_count"],
+        "click_through_count": product["click_through_count"]
+    }
+
+
+class ProductSummaries:
+    """
+    Cache of product_summary() per product, so listings don't rebuild the same dicts
+    on every request. Call refresh(product_id) whenever a product changes (edits,
+    images, wishlists, clicks), or refresh() to drop everything.
+
+    `generation` is bumped only when a summary actually changes, so changes that
+    listings do not show (descriptions, extra images) keep cached listings valid.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._summaries = {product_id: product_summary(product) for product_id, product in products.items()}
+
+    def get(self, product_id):
+        with self._lock:
+            summary = self._summaries.get(product_id)
+            if summary is None:
+                summary = self._summaries[product_id] = product_summary(self.products[product_id])
+            return summary
+
+    def refresh(self, product_id=None):
+        with self._lock:
+            if product_id is None:
+                self._summaries.clear()
+                self.generation += 1
+                return
+            product = self.products.get(product_id)
+            summary = None if product is None else product_summary(product)
+            if self._summaries.get(product_id) != summary:
+                if summary is None:
+                    del self._summaries[product_id]
+                else:
+                    self._summaries[product_id] = summary
+                self.generation += 1
+
+
+def _normalized(values):
+    """
+    Case-insensitive filter values as a hashable, order-independent key.
+    """
+    return tuple(sorted({value.lower() for value in values}))
+
+
+def _product_query():
+    """
+    Parse the product filter parameters shared by /products and /products/facets.
+    Returns the ProductIndex.select keyword arguments except the keyword scores,
+    a normalized, hashable key of the filter for caching, and the
+    SearchIndex.search arguments of the keyword (None without one).
+    """
+    from helper import get_query_list
+
+    main_categories = get_query_list("main_category")
+    sub_categories = get_query_list("sub_category")
+    colors = get_query_list("color")
+    brand_names = get_query_list("brand_name")
+    sizes = get_query_list("size")
+    statuses = get_query_list("status")
+    stock = request.args.get("stock")
+    min_price = request.args.get("min_price", type=float)
+    max_price = request.args.get("max_price", type=float)
+    keyword = request.args.get("keyword")
+    fuzzy = request.args.get("fuzzy", "false").lower() == "true"
+
+    query = {
+        "filters": {
+            "main_category": main_categories,
+            "sub_category": sub_categories,
+            "colour": colors,
+            "brand": brand_names,
+            "status": statuses,
+            "stock": [stock] if stock else [],
+        },
+        "sizes": sizes,
+        "min_price": min_price or None,
+        "max_price": max_price or None,
+    }
+    query_key = (
+        _normalized(main_categories),
+        _normalized(sub_categories),
+        _normalized(colors),
+        _normalized(brand_names),
+        tuple(sorted(set(sizes))),
+        _normalized(statuses),
+        stock.lower() if stock else None,
+        min_price or None,
+        max_price or None,
+        " ".join(tokenize(keyword)) if keyword else None,
+        fuzzy and bool(keyword),
+    )
+    return query, query_key, (keyword, fuzzy) if keyword else None
+
+
+def get_products(product_index, product_summaries, query_cache, search_index):
     def get_products_route():
         """
         Get products with optional filters and sorting (Admin and User)
@@ -60,7 +199,12 @@ def get_products(products):
             in: query
             type: string
             required: false
-            description: "Keyword to search in product name"
+            description: "Words to search for in the product name, brand and sub-category. A product must match every word, and each word also matches longer words that start with it. A keyword without any words matches nothing"
+          - name: fuzzy
+            in: query
+            type: boolean
+            required: false
+            description: "Also match misspelt keyword words by trigram similarity"
           - name: status
             in: query
             type: array
@@ -90,83 +234,261 @@ def get_products(products):
             enum: ["asc", "desc"]
             required: false
             description: "Sort by creation date, ascending or descending"
+          - name: sort_by
+            in: query
+            type: string
+            enum: ["relevance"]
+            required: false
+            description: "Sort keyword matches by relevance, best first. Takes precedence over the other sort options"
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: "Maximum number of products to return. When limit, offset or cursor is given the response is {products, total, offset, limit, next_cursor}"
+          - name: offset
+            in: query
+            type: integer
+            required: false
+            description: "Number of matching products to skip"
+          - name: cursor
+            in: query
+            type: string
+            required: false
+            description: "The next_cursor value of the previous page, used instead of offset"
         responses:
           200:
-            description: List of products matching the filters
+            description: "List of products matching the filters. Sent as newline-delimited JSON, with the pagination values in X-Total, X-Offset, X-Limit and X-Next-Cursor headers, when the Accept header asks for application/x-ndjson"
+          304:
+            description: No product has changed since the version given in If-None-Match or If-Modified-Since
           404:
             description: No products found for the given filters
         """
-        from helper import get_query_list
+        ndjson = wants_ndjson()
+        etag, last_modified = data_validators("products", representation="ndjson" if ndjson else None)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged is not None:
+            return unchanged
 
-        main_categories = get_query_list("main_category")
-        sub_categories = get_query_list("sub_category")
-        colors = get_query_list("color")
-        brand_names = get_query_list("brand_name")
-        sizes = get_query_list("size")
-        statuses = get_query_list("status")
-        stock = request.args.get("stock")
-        min_price = request.args.get("min_price", type=float)
-        max_price = request.args.get("max_price", type=float)
-        keyword = request.args.get("keyword")
+        query, query_key, search = _product_query()
         sort_by_popularity = request.args.get("sort_by_popularity", "false").lower() == "true"
         sort_by_price = request.args.get("sort_by_price")
         sort_by_new = request.args.get("sort_by_new")
+        sort_by = request.args.get("sort_by")
+
+        limit = request.args.get("limit", type=int)
+        offset = request.args.get("offset", type=int)
+        cursor = request.args.get("cursor")
+        paginated = limit is not None or offset is not None or cursor is not None
+
+        if cursor:
+            try:
+                offset = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+        offset = offset or 0
+        if offset < 0 or (limit is not None and limit < 0):
+            return jsonify({"error": "limit and offset must not be negative"}), 400
+
+        sort = None
+        descending = False
+        if sort_by == "relevance":
+            sort = "relevance"
+        elif sort_by_popularity:
+            sort = "popularity"
+        elif sort_by_price:
+            sort, descending = "price", sort_by_price == "desc"
+        elif sort_by_new:
+            sort, descending = "created", sort_by_new == "desc"
+
+        # Only parameters that change the result are part of the key, in a canonical form
+        cache_key = ("products", query_key, sort, descending, paginated, offset, limit)
+        generation = (product_index.generation, product_summaries.generation)
+        cached = None if ndjson else query_cache.get(cache_key, generation)
+        if cached is not None:
+            body, status, variants = cached
+            response = current_app.response_class(body, status=status, mimetype="application/json")
+            response.compressed_variants = variants
+            return set_validators(response, etag, last_modified)
+
+        page_ids, total = product_index.select(
+            **query, sort=sort, descending=descending, offset=offset, limit=limit,
+            scores=search_index.search(*search) if search else None,
+        )
+
+        if total and (ndjson or len(page_ids) > STREAM_MIN_ITEMS):
+            # Too large to build in memory (and so to cache)
+            summaries = (product_summaries.get(product_id) for product_id in page_ids)
+            envelope = None
+            if paginated:
+                next_offset = offset + len(page_ids)
+                envelope = {
+                    "total": total,
+                    "offset": offset,
+                    "limit": limit,
+                    "next_cursor": encode_cursor(next_offset) if next_offset < total else None,
+                }
+            response = stream_list(summaries, envelope, "products" if paginated else None, ndjson)
+            return set_validators(response, etag, last_modified), 200
+
+        filtered_products = [product_summaries.get(product_id) for product_id in page_ids]
+
+        if not total:
+            response, status = jsonify({"message": "No products found"}), 404
+        elif paginated:
+            next_offset = offset + len(filtered_products)
+            response, status = jsonify({
+                "products": filtered_products,
+                "total": total,
+                "offset": offset,
+                "limit": limit,
+                "next_cursor": encode_cursor(next_offset) if next_offset < total else None,
+            }), 200
+        else:
+            response, status = jsonify(filtered_products), 200
 
-        filtered_products_set = {
-            product["product_id"]: {
-                "product_id": product["product_id"],
-                "name": product["name"],
-                "price": float(product["price"]),
-                "previous_price": float(product["previous_price"]),
-                "main_category": product["main_category"],
-                "sub_category": product["sub_category"],
-                "brand": product["brand"],
-                "color": product["colour"],
-                "size": product["size"],
-                "first_image": (
-                    product["picture_urls"][0] if product["picture_urls"] else None
-                ),
-                "time_created": product["time_created"],
-                "wishlister_count": len(set(product.get("wishlister_users", []))),
-                "product_url": product["product_url"],
-                "stock": product["stock"],
-                "status": product["status"],
-                "click_count": product["click_count"],
-                "click_through_count": product["click_through_count"]
-            }
-            for product in products.values()
-            if (
-                (not main_categories or any(cat.lower() in product["main_category"].lower() for cat in main_categories))
-                and (not sub_categories or any(sub.lower() in product["sub_category"].lower() for sub in sub_categories))
-                and (not colors or any(c.lower() in product["colour"].lower() for c in colors))
-                and (not brand_names or any(b.lower() in product["brand"].lower() for b in brand_names))
-                and (not sizes or any(
-                    size.split(":")[0] in sizes and size.split(":")[1] == "1"
-                    for size in product["size"]
-                ))
-                and (not statuses or any(status.lower() == product["status"].lower() for status in statuses))
-                and (not stock or product["stock"].lower() == stock.lower())
-                and (not min_price or float(product["price"]) >= min_price)
-                and (not max_price or float(product["price"]) <= max_price)
-                and (not keyword or keyword.lower() in product["name"].lower())
-            )
-        }
+        response.compressed_variants = query_cache.put(cache_key, generation, response.get_data(), status)
+        return set_validators(response, etag, last_modified), status
 
-        filtered_products = list(filtered_products_set.values())
+    return get_products_route
 
-        if sort_by_popularity:
-            filtered_products.sort(key=lambda p: p["wishlister_count"], reverse=True)
-        elif sort_by_price:
-            filtered_products.sort(key=lambda p: p["price"], reverse=(sort_by_price == "desc"))
-        elif sort_by_new:
-            filtered_products.sort(key=lambda p: p["time_created"], reverse=(sort_by_new == "desc"))
 
-        if not filtered_products:
-            return jsonify({"message": "No products found"}), 404
+def get_product_facets(product_index, query_cache, search_index):
+    def get_product_facets_route():
+        """
+        Count the products matching a filter per facet (Admin and User)
+        ---
+        tags:
+          - Products
+        parameters:
+          - name: main_category
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: sub_category
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: color
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: brand_name
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: size
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: min_price
+            in: query
+            type: number
+            required: false
+          - name: max_price
+            in: query
+            type: number
+            required: false
+          - name: keyword
+            in: query
+            type: string
+            required: false
+          - name: status
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+          - name: stock
+            in: query
+            type: string
+            required: false
+        responses:
+          200:
+            description: "The number of matching products and their counts per brand, colour, size, status, sub_category and price range"
+        """
+        query, query_key, search = _product_query()
+        cache_key = ("facets", query_key)
+        generation = product_index.generation
+        cached = query_cache.get(cache_key, generation)
+        if cached is not None:
+            body, status, variants = cached
+            response = current_app.response_class(body, status=status, mimetype="application/json")
+            response.compressed_variants = variants
+            return response
+
+        product_ids, total = product_index.select(**query, scores=search_index.search(*search) if search else None)
+        response = jsonify({"total": total, "facets": product_index.facets(product_ids)})
+        response.compressed_variants = query_cache.put(cache_key, generation, response.get_data(), 200)
+        return response, 200
+
+    return get_product_facets_route
+
+
+def get_suggestions(suggest_index):
+    def get_suggestions_route():
+        """
+        Suggest products, brands and categories while typing (Admin and User)
+        ---
+        tags:
+          - Products
+        parameters:
+          - name: q
+            in: query
+            type: string
+            required: true
+            description: "The text typed so far; the last word may be incomplete"
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: "Maximum number of suggestions (default 10, at most 50)"
+        responses:
+          200:
+            description: "The most popular matching labels, each with its type (product, brand, main_category or sub_category), label and value (product id, brand id or category slug)"
+        """
+        limit = request.args.get("limit", DEFAULT_SUGGESTIONS, type=int)
+        limit = max(0, min(limit, MAX_SUGGESTIONS))
+        return jsonify({"suggestions": suggest_index.suggest(request.args.get("q", ""), limit)}), 200
 
-        return jsonify(filtered_products), 200
+    return get_suggestions_route
 
-    return get_products_route
+
+def get_size_matrix(product_index):
+    def get_size_matrix_route():
+        """
+        Get the in-stock size matrix of the products (Admin and User)
+        ---
+        tags:
+          - Products
+        parameters:
+          - name: product_id
+            in: query
+            type: array
+            items:
+              type: string
+            required: false
+            description: "Products to include, all products if omitted"
+        responses:
+          200:
+            description: "The size labels and, per product id, a 0/1 in-stock flag for each label"
+        """
+        from helper import get_query_list
+
+        product_ids = get_query_list("product_id")
+        sizes, rows = product_index.size_matrix(product_ids or None)
+        return jsonify({"sizes": sizes, "products": rows}), 200
+
+    return get_size_matrix_route
 
 
 def get_single_product(products):
@@ -185,13 +507,19 @@ def get_single_product(products):
         responses:
           200:
             description: Returns a single product
+          304:
+            description: The product has not changed since the version given in If-None-Match or If-Modified-Since
           404:
             description: Product not found
         """
         product = products.get(product_id)
         if not product:
             return jsonify({"error": "Product not found"}), 404
-        return jsonify(product), 200
+        etag, last_modified = data_validators("products", product_id)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+        return set_validators(jsonify(product), etag, last_modified), 200
 
     return get_single_product_route
 
@@ -309,15 +637,14 @@ def add_product(users, products, brands):
             "click_through_count": 0
         }
 
-        products[product_id] = new_product
-
         brand = brands.get(data["brand_id"])
-        if brand:
-            brand["product_list"].append(product_id)
-        else:
+        if not brand:
             return jsonify({"error": "Brand not found"}), 404
 
-        save_data(users, brands, products)
+        products[product_id] = new_product
+        brand["product_list"].append(product_id)
+
+        save_data(users, brands, products, [("products", product_id), ("brands", data["brand_id"])])
 
         return jsonify({"message": "Product added successfully", "product_id": product_id}), 200
 
@@ -382,7 +709,7 @@ def upload_product_image(users, products, brands):
         product_url = f"/api/static/product_images/{product_id}/{filename}"
         if product_url not in product["picture_urls"]:
             product["picture_urls"].append(product_url)
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("products", product_id)])
 
         return jsonify({"message": "Image uploaded successfully", "filename": filename}), 200
 
@@ -443,7 +770,7 @@ def delete_product_image(users, products, brands):
 
         if image_url in product["picture_urls"]:
             product["picture_urls"].remove(image_url)
-            save_data(users, brands, products)
+            save_data(users, brands, products, [("products", product_id)])
 
         return jsonify({"message": "Image deleted successfully"}), 200
 
@@ -492,7 +819,7 @@ def delete_product(users, products, brands):
             import shutil
             shutil.rmtree(picture_folder)
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("products", product_id), ("brands", product["brand_id"])])
 
         return jsonify({"message": "Product deleted successfully"}), 200
 
@@ -612,7 +939,7 @@ def edit_product(users, products, brands):
             "time_modified": datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=10))).strftime('%Y-%m-%dT%H:%M:%S%z')[:-2] + ':' + datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=10))).strftime('%z')[-2:]
         })
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("products", product_id)])
 
         return jsonify({"message": "Product updated successfully"}), 200
 
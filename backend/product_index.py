@@ -0,0 +1,381 @@
+import bisect
+import heapq
+import datetime
+import itertools
+import threading
+from collections import Counter
+from product_columns import ProductColumns, columns_available
+
+# Query values match any indexed value that contains them, e.g. "shirt" matches "T-Shirts"
+SUBSTRING_ATTRIBUTES = ("main_category", "sub_category", "colour", "brand")
+# Query values must equal the indexed value, ignoring case
+EXACT_ATTRIBUTES = ("status", "stock")
+# Lower bounds of the price ranges counted by facets(), the last range is open-ended
+PRICE_FACET_BOUNDS = (0, 50, 100, 200, 500)
+# Walking a sorted index only pays off when the filter keeps a good share of the catalog
+SORT_WALK_MIN_FRACTION = 1 / 8
+
+
+class ProductIndex:
+    """
+    Inverted indexes over the products store, mapping each lowercased attribute
+    value to the set of product ids that have it. Filtering a query becomes a
+    handful of set unions and intersections instead of a scan of every product.
+
+    Price and creation time are kept in sorted (value, position, product_id)
+    lists, so price ranges are found with bisect and sorted results come from
+    walking the list instead of sorting the matches.
+
+    In-stock sizes are parsed once per product into a bitmask over a global
+    size vocabulary, plus a size -> product ids index.
+
+    With `columnar` and NumPy installed, queries run against a ProductColumns
+    copy of the same data instead, as vectorized masks and sorts.
+
+    Call refresh(product_id) whenever a product is added, edited or deleted, or
+    refresh() to rebuild everything. A refresh (or refresh_many() of a batch)
+    that changes any indexed value bumps `generation`, which caches of query
+    results use to notice that the catalog changed.
+    """
+
+    def __init__(self, products, columnar=False):
+        self.products = products
+        self.columnar = columnar and columns_available()
+        self.generation = 0
+        self._lock = threading.RLock()
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._postings = {attribute: {} for attribute in SUBSTRING_ATTRIBUTES + EXACT_ATTRIBUTES}
+            self._entries = {}  # product_id -> indexed attribute values
+            self._positions = {}  # product_id -> position in catalog order
+            self._next_position = 0
+            self._price = {}  # product_id -> price
+            self._created = {}  # product_id -> time_created as epoch seconds
+            self._popularity = {}  # product_id -> wishlister count
+            self._by_price = []  # Sorted (price, position, product_id)
+            self._by_created = []  # Sorted (time_created, position, product_id)
+            self._size_bits = {}  # size label -> bit, never reused so masks stay valid
+            self._size_masks = {}  # product_id -> bitmask of in-stock sizes
+            self._size_postings = {}  # size label -> product ids with it in stock
+            self.columns = ProductColumns(SUBSTRING_ATTRIBUTES + EXACT_ATTRIBUTES) if self.columnar else None
+            for product_id in list(self.products):
+                self._index(product_id)
+
+    def refresh(self, product_id=None):
+        self.refresh_many(None if product_id is None else [product_id])
+
+    def refresh_many(self, product_ids):
+        """
+        Refresh each of `product_ids` (everything if None), bumping `generation`
+        once if anything indexed changed.
+        """
+        with self._lock:
+            if product_ids is None:
+                self.generation += 1
+                self.rebuild()
+                return
+            changed = False
+            for product_id in product_ids:
+                if product_id in self.products:
+                    changed = self._index(product_id) or changed
+                else:
+                    changed = self._unindex(product_id) or changed
+            if changed:
+                self.generation += 1
+
+    def select(self, filters, sizes=None, min_price=None, max_price=None, sort=None, descending=False,
+               offset=0, limit=None, scores=None):
+        """
+        Find the products matching every attribute in `filters` (attribute ->
+        list of query values, any of which may match), having any of `sizes` in
+        stock, within the optional price range and, if `scores`
+        ({product_id: relevance}) is given, among its keys. Empty filters are
+        ignored.
+
+        Results are in catalog order, or ordered by `sort`: "price", "created",
+        "popularity" (wishlister count, highest first) or "relevance" (highest
+        score first). Equal values keep catalog order. Price and creation order
+        come from walking a sorted index when the filter keeps a large share of
+        the catalog, stopping once the `offset`/`limit` window is full. Otherwise
+        the matches go through a heap bounded to `offset + limit` entries, or
+        are sorted in full when there is no `limit`. The NumPy columns have
+        their own strategy, see ProductColumns.select.
+
+        Returns (product_ids, total) where total counts every match.
+        """
+        if sort == "relevance" and scores is None:
+            sort = None
+        with self._lock:
+            if self.columns is not None:
+                return self.columns.select(
+                    filters, self._matching_values, sizes, min_price, max_price, sort, descending,
+                    offset, limit, scores,
+                )
+
+            matched = None  # None stands for every product
+            for attribute, values in filters.items():
+                if not values:
+                    continue
+                ids = self._match(attribute, values)
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    return [], 0
+
+            if scores is not None:
+                matched = set(scores) if matched is None else matched & scores.keys()
+                if not matched:
+                    return [], 0
+
+            if sizes:
+                wanted = self.size_mask(sizes)
+                if not wanted:
+                    return [], 0
+                if matched is None:
+                    matched = set()
+                    for size in set(sizes):
+                        matched |= self._size_postings.get(size, set())
+                else:
+                    masks = self._size_masks
+                    matched = {product_id for product_id in matched if masks[product_id] & wanted}
+                if not matched:
+                    return [], 0
+
+            lo, hi = 0, len(self._by_price)
+            if min_price is not None:
+                lo = bisect.bisect_left(self._by_price, (min_price,))
+            if max_price is not None:
+                # Clamped so min_price > max_price gives an empty range, not a negative total
+                hi = max(bisect.bisect_right(self._by_price, (max_price, float("inf"))), lo)
+            if (lo > 0 or hi < len(self._by_price)) and not (sort == "price" and matched is None):
+                in_range = {product_id for _, _, product_id in self._by_price[lo:hi]}
+                matched = in_range if matched is None else matched & in_range
+
+            stop = None if limit is None else offset + limit
+
+            if matched is None:
+                if sort == "price":
+                    return list(itertools.islice(self._walk(self._by_price, lo, hi, descending), offset, stop)), hi - lo
+                if sort == "created":
+                    walk = self._walk(self._by_created, 0, len(self._by_created), descending)
+                    return list(itertools.islice(walk, offset, stop)), len(self._positions)
+                if sort is None:
+                    return list(itertools.islice(self._positions, offset, stop)), len(self._positions)
+                candidates = self._positions
+            else:
+                candidates = matched
+                if sort in ("price", "created") and len(matched) >= len(self._positions) * SORT_WALK_MIN_FRACTION:
+                    ordered = self._by_price if sort == "price" else self._by_created
+                    walk = (
+                        product_id for product_id in self._walk(ordered, 0, len(ordered), descending)
+                        if product_id in matched
+                    )
+                    return list(itertools.islice(walk, offset, stop)), len(matched)
+
+            # Few matches, or an order without a sorted index
+            key = self._sort_key(sort, descending, scores)
+            if stop is None:
+                ordered_ids = sorted(candidates, key=key)
+            else:
+                ordered_ids = heapq.nsmallest(stop, candidates, key=key)
+            return ordered_ids[offset:], len(candidates)
+
+    def facets(self, product_ids):
+        """
+        Count the given products per brand, colour, in-stock size, status,
+        sub_category and price range, in a single pass over their index entries.
+        """
+        labels = [
+            f"{low:g}-{high:g}" for low, high in zip(PRICE_FACET_BOUNDS, PRICE_FACET_BOUNDS[1:])
+        ] + [f"{PRICE_FACET_BOUNDS[-1]:g}+"]
+        counts = {
+            "brand": Counter(),
+            "colour": Counter(),
+            "size": Counter(),
+            "status": Counter(),
+            "sub_category": Counter(),
+            "price": dict.fromkeys(labels, 0),
+        }
+        with self._lock:
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is None:
+                    continue
+                # Counted by the stored spelling rather than the lowercased index value
+                product = self.products[product_id]
+                for attribute in ("brand", "colour", "status", "sub_category"):
+                    counts[attribute][product.get(attribute, "")] += 1
+                counts["size"].update(entry["sizes"])
+                bucket = max(bisect.bisect_right(PRICE_FACET_BOUNDS, entry["price"]) - 1, 0)
+                counts["price"][labels[bucket]] += 1
+        return {facet: dict(values) for facet, values in counts.items()}
+
+    def size_mask(self, sizes):
+        """
+        Bitmask of the given size labels; labels no product has are ignored.
+        """
+        mask = 0
+        for size in sizes:
+            bit = self._size_bits.get(size)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def size_matrix(self, product_ids=None):
+        """
+        The size vocabulary and, for each product (all of them by default), a
+        row of 0/1 in-stock flags in vocabulary order.
+        """
+        with self._lock:
+            labels = sorted(self._size_bits, key=self._size_bits.get)
+            bits = [self._size_bits[label] for label in labels]
+            if product_ids is None:
+                product_ids = self._positions
+            rows = {
+                product_id: [(self._size_masks[product_id] >> bit) & 1 for bit in bits]
+                for product_id in product_ids
+                if product_id in self._size_masks
+            }
+            return labels, rows
+
+    def _sort_key(self, sort, descending, scores=None):
+        positions = self._positions
+        if sort is None:
+            return positions.__getitem__
+        if sort == "relevance":
+            return lambda product_id: (-scores[product_id], positions[product_id])
+        if sort == "popularity":
+            return lambda product_id: (-self._popularity[product_id], positions[product_id])
+        values = self._price if sort == "price" else self._created
+        sign = -1 if descending else 1
+        return lambda product_id: (sign * values[product_id], positions[product_id])
+
+    @staticmethod
+    def _walk(ordered, start, stop, descending):
+        if not descending:
+            for _, _, product_id in ordered[start:stop]:
+                yield product_id
+            return
+        # Walk runs of equal values backwards, each run in catalog order
+        end = stop
+        while end > start:
+            begin = bisect.bisect_left(ordered, (ordered[end - 1][0],), start, end)
+            for _, _, product_id in ordered[begin:end]:
+                yield product_id
+            end = begin
+
+    def _matching_values(self, attribute, values):
+        """
+        The indexed values of `attribute` that any of the query `values` match.
+        """
+        postings = self._postings[attribute]
+        matched = set()
+        for value in values:
+            value = value.lower()
+            if attribute in EXACT_ATTRIBUTES:
+                if value in postings:
+                    matched.add(value)
+            else:
+                # The number of distinct values is small compared to the catalog
+                matched.update(indexed_value for indexed_value in postings if value in indexed_value)
+        return matched
+
+    def _match(self, attribute, values):
+        postings = self._postings[attribute]
+        ids = set()
+        for value in self._matching_values(attribute, values):
+            ids |= postings[value]
+        return ids
+
+    def _index(self, product_id):
+        product = self.products[product_id]
+        entry = {attribute: str(product.get(attribute, "")).lower() for attribute in self._postings}
+        entry["price"] = _parse_price(product.get("price"))
+        entry["time_created"] = _parse_time(product.get("time_created"))
+        entry["popularity"] = len(set(product.get("wishlister_users", [])))
+        entry["sizes"] = _in_stock_sizes(product.get("size"))
+        if self._entries.get(product_id) == entry:
+            return False
+
+        self._unindex(product_id, keep_position=True)
+        if product_id not in self._positions:
+            self._positions[product_id] = self._next_position
+            self._next_position += 1
+        position = self._positions[product_id]
+
+        self._entries[product_id] = entry
+        for attribute in self._postings:
+            self._postings[attribute].setdefault(entry[attribute], set()).add(product_id)
+        self._price[product_id] = entry["price"]
+        self._created[product_id] = entry["time_created"]
+        self._popularity[product_id] = entry["popularity"]
+        bisect.insort(self._by_price, (entry["price"], position, product_id))
+        bisect.insort(self._by_created, (entry["time_created"], position, product_id))
+        mask = 0
+        for size in entry["sizes"]:
+            bit = self._size_bits.setdefault(size, len(self._size_bits))
+            mask |= 1 << bit
+            self._size_postings.setdefault(size, set()).add(product_id)
+        self._size_masks[product_id] = mask
+        if self.columns is not None:
+            self.columns.upsert(product_id, entry, position, entry["sizes"])
+        return True
+
+    def _unindex(self, product_id, keep_position=False):
+        entry = self._entries.pop(product_id, None)
+        if entry:
+            for attribute in self._postings:
+                product_ids = self._postings[attribute][entry[attribute]]
+                product_ids.discard(product_id)
+                if not product_ids:
+                    del self._postings[attribute][entry[attribute]]
+            position = self._positions[product_id]
+            _remove_sorted(self._by_price, (entry["price"], position, product_id))
+            _remove_sorted(self._by_created, (entry["time_created"], position, product_id))
+            del self._price[product_id]
+            del self._created[product_id]
+            del self._popularity[product_id]
+            del self._size_masks[product_id]
+            for size in entry["sizes"]:
+                product_ids = self._size_postings[size]
+                product_ids.discard(product_id)
+                if not product_ids:
+                    del self._size_postings[size]
+        if not keep_position:
+            self._positions.pop(product_id, None)
+            if self.columns is not None:
+                self.columns.remove(product_id)
+        return entry is not None
+
+
+def _remove_sorted(ordered, item):
+    index = bisect.bisect_left(ordered, item)
+    if index < len(ordered) and ordered[index] == item:
+        del ordered[index]
+
+
+def _in_stock_sizes(sizes):
+    """
+    Labels of the sizes marked available in a list like ["XS:1", "S:0"].
+    """
+    labels = []
+    for size in sizes or []:
+        parts = str(size).split(":")
+        if len(parts) > 1 and parts[1] == "1":
+            labels.append(parts[0])
+    return tuple(dict.fromkeys(labels))
+
+
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _parse_time(value):
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    LRU cache of serialized responses keyed by a normalized query.
+
+    Every entry remembers the catalog generation it was computed at; a lookup
+    with a newer generation is a miss, so bumping the generation on any product
+    change invalidates everything at once without walking the cache. Entries
+    also expire after `ttl` seconds, and the least recently used ones are
+    evicted once the stored bodies exceed `max_bytes`.
+
+    Each entry also carries a dict of compressed variants of its body
+    (encoding -> bytes), filled in by the compression middleware the first time
+    an encoding is requested. Variants are smaller than the body and are not
+    counted against `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (generation, expires_at, body, status, variants)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation):
+        """
+        Return the cached (body, status, variants) for `key`, or None if it is missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_generation, expires_at, body, status, variants = entry
+            if entry_generation != generation or expires_at < time.monotonic():
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, status, variants
+
+    def put(self, key, generation, body, status):
+        """
+        Cache `body` and return the dict for its compressed variants.
+        """
+        variants = {}
+        if len(body) > self.max_bytes:
+            return variants
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (generation, time.monotonic() + self.ttl, body, status, variants)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+        return variants
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[2])
@@ -0,0 +1,236 @@
+import bisect
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+# Product fields that are searched, and how much a term occurrence in each counts
+SEARCH_FIELDS = {"name": 2.0, "brand": 1.0, "sub_category": 1.0}
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Weight of a term that only extends a query token, e.g. "shirts" for "shirt"
+PREFIX_MATCH_WEIGHT = 0.5
+# Trigram similarity (shared / all distinct trigrams) a term needs to match a misspelt token
+FUZZY_MIN_SIMILARITY = 0.3
+# How far the average document length may drift before the cached BM25 term weights are recomputed
+LENGTH_DRIFT_TOLERANCE = 0.05
+# Searches whose scores are kept until the index changes
+SEARCH_CACHE_SIZE = 64
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Lowercase alphanumeric tokens of `text`; apostrophes are dropped so that
+    "Alfie's" is the single token "alfies".
+    """
+    return _TOKEN.findall(str(text).lower().replace("'", "").replace("’", ""))
+
+
+def trigrams(term):
+    """
+    Character trigrams of `term`, padded so that short terms and word starts count.
+    """
+    padded = f"  {term} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Inverted token index over the SEARCH_FIELDS of every product, for keyword
+    search. Every query token must match a token of the product, either exactly
+    or as a prefix ("jack" finds "jacket"), and matches are scored with BM25.
+
+    The vocabulary is also kept as a sorted list, so the terms extending a
+    prefix are found with bisect rather than by scanning the vocabulary, and
+    in a trigram index for fuzzy search: a misspelt token matches the terms
+    sharing enough of its trigrams, weighted by their similarity.
+
+    The length-normalized BM25 weight of every posting is computed once per
+    term and cached, against an average document length that is only updated
+    when it drifts by more than LENGTH_DRIFT_TOLERANCE, so a search costs a
+    multiplication per posting. The scores of recent searches are cached too,
+    until the index changes.
+
+    Call refresh(product_id) whenever a product is added, edited or deleted,
+    or refresh() to rebuild everything.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self._lock = threading.RLock()
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._postings = {}  # term -> {product_id: weighted term frequency}
+            self._terms = []  # Sorted vocabulary
+            self._trigram_terms = {}  # trigram -> terms containing it
+            self._documents = {}  # product_id -> (term frequencies, document length)
+            self._total_length = 0.0
+            self._weights = {}  # term -> {product_id: length-normalized term frequency}
+            self._weights_length = None  # Average document length the cached weights were computed with
+            self._results = OrderedDict()  # (tokens, fuzzy) -> scores of a recent search
+            for product_id in list(self.products):
+                self._index(product_id)
+
+    def refresh(self, product_id=None):
+        with self._lock:
+            if product_id is None:
+                self.rebuild()
+            elif product_id in self.products:
+                self._index(product_id)
+            else:
+                self._unindex(product_id)
+
+    def search(self, query, fuzzy=False):
+        """
+        Score the products matching every token of `query`, allowing
+        misspellings with `fuzzy`.
+        Returns {product_id: score}, shared with later identical searches so it
+        must not be modified. A query without tokens matches nothing.
+        """
+        tokens = tuple(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return {}
+
+        with self._lock:
+            count = len(self._documents)
+            if not count:
+                return {}
+            average_length = self._total_length / count
+            if (
+                self._weights_length is None
+                or abs(average_length - self._weights_length) > LENGTH_DRIFT_TOLERANCE * self._weights_length
+            ):
+                self._weights_length = average_length
+                self._weights.clear()
+                self._results.clear()
+
+            cache_key = (tokens, fuzzy)
+            scores = self._results.get(cache_key)
+            if scores is not None:
+                self._results.move_to_end(cache_key)
+                return scores
+
+            for token in tokens:
+                terms = self._similar(token) if fuzzy else {}
+                for term in self._expand(token):
+                    terms[term] = max(terms.get(term, 0.0), 1.0 if term == token else PREFIX_MATCH_WEIGHT)
+
+                token_scores = None
+                for term, weight in terms.items():
+                    postings = self._postings[term]
+                    # BM25 idf, kept positive for terms found in most products
+                    idf = weight * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    weights = self._term_weights(term)
+                    if token_scores is None:
+                        token_scores = {product_id: idf * value for product_id, value in weights.items()}
+                    else:
+                        for product_id, value in weights.items():
+                            token_scores[product_id] = token_scores.get(product_id, 0.0) + idf * value
+                token_scores = token_scores or {}
+                if scores is None:
+                    scores = token_scores
+                else:
+                    if len(token_scores) < len(scores):
+                        scores, token_scores = token_scores, scores
+                    scores = {
+                        product_id: score + token_scores[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in token_scores
+                    }
+                if not scores:
+                    break
+
+            self._results[cache_key] = scores
+            if len(self._results) > SEARCH_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return scores
+
+    def _term_weights(self, term):
+        """
+        {product_id: BM25 term frequency component} of `term`, without its idf.
+        """
+        weights = self._weights.get(term)
+        if weights is None:
+            documents = self._documents
+            base = BM25_K1 * (1 - BM25_B)
+            scale = BM25_K1 * BM25_B / self._weights_length
+            weights = self._weights[term] = {
+                product_id: frequency * (BM25_K1 + 1) / (frequency + base + scale * documents[product_id][1])
+                for product_id, frequency in self._postings[term].items()
+            }
+        return weights
+
+    def _expand(self, token):
+        """
+        The indexed terms starting with `token`.
+        """
+        start = bisect.bisect_left(self._terms, token)
+        stop = start
+        while stop < len(self._terms) and self._terms[stop].startswith(token):
+            stop += 1
+        return self._terms[start:stop]
+
+    def _similar(self, token):
+        """
+        {term: similarity} of the indexed terms similar enough to `token`.
+        """
+        token_trigrams = trigrams(token)
+        shared = Counter()
+        for trigram in token_trigrams:
+            shared.update(self._trigram_terms.get(trigram, ()))
+        similar = {}
+        for term, count in shared.items():
+            similarity = count / (len(token_trigrams) + len(trigrams(term)) - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                similar[term] = similarity
+        return similar
+
+    def _index(self, product_id):
+        product = self.products[product_id]
+        frequencies = Counter()
+        length = 0.0
+        for field, weight in SEARCH_FIELDS.items():
+            for token in tokenize(product.get(field, "")):
+                frequencies[token] += weight
+                length += weight
+        if self._documents.get(product_id) == (frequencies, length):
+            return
+
+        self._unindex(product_id)
+        self._documents[product_id] = (frequencies, length)
+        self._total_length += length
+        self._results.clear()
+        for term, frequency in frequencies.items():
+            self._weights.pop(term, None)
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+                for trigram in trigrams(term):
+                    self._trigram_terms.setdefault(trigram, set()).add(term)
+            postings[product_id] = frequency
+
+    def _unindex(self, product_id):
+        document = self._documents.pop(product_id, None)
+        if document is None:
+            return
+        frequencies, length = document
+        self._total_length -= length
+        self._results.clear()
+        for term in frequencies:
+            self._weights.pop(term, None)
+            postings = self._postings[term]
+            del postings[product_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+                for trigram in trigrams(term):
+                    terms = self._trigram_terms[trigram]
+                    terms.discard(term)
+                    if not terms:
+                        del self._trigram_terms[trigram]
@@ -0,0 +1,375 @@
+import os
+import sys
+import json
+import zlib
+import sqlite3
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+COLLECTIONS = ("users", "brands", "products")
+
+
+class Storage:
+    """
+    Interface between the in-memory users/brands/products dictionaries and disk.
+    `stores` is always a dict mapping each name in COLLECTIONS to its dictionary.
+    """
+
+    def load(self, stores):
+        """
+        Fill `stores` from disk. Returns False if there is nothing stored yet.
+        """
+        raise NotImplementedError
+
+    def write(self, stores, changes, sync=False):
+        """
+        Persist the current value (or absence) of each (collection, key) pair in `changes`.
+        """
+        raise NotImplementedError
+
+    def write_all(self, stores):
+        """
+        Replace everything on disk with the contents of `stores`.
+        """
+        raise NotImplementedError
+
+
+class JsonStorage(Storage):
+    """
+    Snapshot + write-ahead log persistence for the users/brands/products stores.
+
+    The snapshot is the regular database.json file. Every mutation is appended to
+    a log file next to it as one JSON line, so a write costs the size of the
+    changed record rather than the size of the whole database. Once the log holds
+    `compact_threshold` records it is folded back into a fresh snapshot.
+    """
+
+    def __init__(self, path, compact_threshold=1000):
+        self.path = path
+        self.wal_path = os.path.splitext(path)[0] + ".wal"
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._wal_records = 0
+
+    def load(self, stores):
+        """
+        Load the snapshot and replay the log into `stores`.
+        Returns False if neither file exists yet.
+        """
+        found = False
+        if os.path.exists(self.path):
+            found = True
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            for collection in COLLECTIONS:
+                stores[collection].update(data.get(collection, {}))
+
+        if os.path.exists(self.wal_path):
+            found = True
+            self._wal_records = self._replay(stores)
+
+        return found
+
+    def write(self, stores, changes, sync=False):
+        """
+        Append one log record per (collection, key) pair in `changes`. Keys that
+        are no longer in their store are logged as deletions. With `sync` the log
+        is fsynced before returning.
+        """
+        lines = []
+        for collection, key in dict.fromkeys(changes):
+            store = stores[collection]
+            if key in store:
+                record = {"op": "put", "collection": collection, "key": key, "value": store[key]}
+            else:
+                record = {"op": "delete", "collection": collection, "key": key}
+            lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+
+        if not lines:
+            return
+
+        with self._lock:
+            with open(self.wal_path, "a") as file:
+                file.writelines(lines)
+                if sync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._wal_records += len(lines)
+            if self._wal_records >= self.compact_threshold:
+                self._compact(stores)
+
+    def write_all(self, stores):
+        """
+        Write a full snapshot and discard the log.
+        """
+        with self._lock:
+            self._compact(stores)
+
+    def _replay(self, stores):
+        count = 0
+        end = 0  # Offset just past the last complete record
+        with open(self.wal_path, "rb") as file:
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Unterminated record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write can only affect the tail of the log
+                    break
+                store = stores[record["collection"]]
+                if record["op"] == "put":
+                    store[record["key"]] = record["value"]
+                else:
+                    store.pop(record["key"], None)
+                count += 1
+                end += len(line)
+        if end < os.path.getsize(self.wal_path):
+            # Drop the torn tail, or every record appended after it would be unreadable
+            with open(self.wal_path, "r+b") as file:
+                file.truncate(end)
+                file.flush()
+                os.fsync(file.fileno())
+        return count
+
+    def _compact(self, stores):
+        # Records are full values, so replaying a log that survived a crash
+        # between the rename and the truncate below is harmless.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({collection: stores[collection] for collection in COLLECTIONS}, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        open(self.wal_path, "w").close()
+        self._wal_records = 0
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite persistence with one row per entity, so an update only touches the
+    changed rows. The database runs in WAL journal mode, and the product
+    columns used for filtering (brand_id, sub_category, price, time_created)
+    are stored separately and indexed.
+
+    If the database is empty and `seed_path` points at an existing JSON
+    database, it is imported on the first load.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS brands (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS products (
+            key TEXT PRIMARY KEY,
+            brand_id TEXT,
+            sub_category TEXT,
+            price REAL,
+            time_created REAL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS products_brand_id ON products (brand_id);
+        CREATE INDEX IF NOT EXISTS products_sub_category ON products (sub_category);
+        CREATE INDEX IF NOT EXISTS products_price ON products (price);
+        CREATE INDEX IF NOT EXISTS products_time_created ON products (time_created);
+    """
+
+    def __init__(self, path, seed_path=None):
+        self.path = path
+        self.seed_path = seed_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")  # Every commit is durable, `sync` needs no extra work
+        self._conn.executescript(self.SCHEMA)
+
+    def load(self, stores):
+        with self._lock:
+            empty = all(
+                self._conn.execute(f"SELECT 1 FROM {collection} LIMIT 1").fetchone() is None
+                for collection in COLLECTIONS
+            )
+        if empty:
+            if not self.seed_path or not os.path.exists(self.seed_path):
+                return False
+            self.migrate(self.seed_path)
+
+        with self._lock:
+            for collection in COLLECTIONS:
+                for key, data in self._conn.execute(f"SELECT key, data FROM {collection}"):
+                    stores[collection][key] = json.loads(data)
+        return True
+
+    def write(self, stores, changes, sync=False):
+        with self._lock, self._conn:
+            for collection, key in dict.fromkeys(changes):
+                store = stores[collection]
+                if key in store:
+                    self._put(collection, key, store[key])
+                else:
+                    self._conn.execute(f"DELETE FROM {collection} WHERE key = ?", (key,))
+
+    def write_all(self, stores):
+        with self._lock, self._conn:
+            for collection in COLLECTIONS:
+                self._conn.execute(f"DELETE FROM {collection}")
+                for key, value in stores[collection].items():
+                    self._put(collection, key, value)
+
+    def migrate(self, json_path):
+        """
+        One-shot import of a JSON database (snapshot plus its write-ahead log),
+        replacing the current contents.
+        """
+        stores = {collection: {} for collection in COLLECTIONS}
+        JsonStorage(json_path).load(stores)
+        self.write_all(stores)
+
+    def _put(self, collection, key, value):
+        data = json.dumps(value, separators=(",", ":"))
+        if collection == "products":
+            self._conn.execute(
+                "INSERT OR REPLACE INTO products (key, brand_id, sub_category, price, time_created, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    value.get("brand_id"),
+                    value.get("sub_category"),
+                    _to_float(value.get("price")),
+                    _to_epoch(value.get("time_created")),
+                    data,
+                ),
+            )
+        else:
+            self._conn.execute(f"INSERT OR REPLACE INTO {collection} (key, data) VALUES (?, ?)", (key, data))
+
+
+class ShardedJsonStorage(Storage):
+    """
+    One directory per collection, each split into JSON shard files by key hash
+    (e.g. products/shard-07.json). A write only rewrites the shards holding a
+    changed key, each atomically through a temp file and rename, so a product
+    click never rewrites users or brand logos.
+
+    If the directory holds no shards and `seed_path` points at an existing
+    JSON database, it is imported on the first load.
+    """
+
+    def __init__(self, directory, shard_counts, seed_path=None, load_workers=8):
+        self.directory = directory
+        self.shard_counts = shard_counts
+        self.seed_path = seed_path
+        self.load_workers = load_workers
+        self._lock = threading.Lock()
+        # Keys held by each shard, so a shard can be rewritten without scanning its whole collection
+        self._members = {
+            collection: [set() for _ in range(shard_counts[collection])] for collection in COLLECTIONS
+        }
+
+    def shard_of(self, collection, key):
+        return zlib.crc32(str(key).encode()) % self.shard_counts[collection]
+
+    def load(self, stores):
+        files = [
+            (collection, os.path.join(self.directory, collection, filename))
+            for collection in COLLECTIONS
+            if os.path.isdir(os.path.join(self.directory, collection))
+            for filename in sorted(os.listdir(os.path.join(self.directory, collection)))
+            if filename.startswith("shard-") and filename.endswith(".json")
+        ]
+        if not files:
+            if not self.seed_path or not os.path.exists(self.seed_path):
+                return False
+            JsonStorage(self.seed_path).load(stores)
+            self.write_all(stores)
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+            shards = list(executor.map(lambda item: self._read_shard(item[1]), files))
+
+        expected = {
+            self._shard_path(collection, shard)
+            for collection in COLLECTIONS
+            for shard in range(self.shard_counts[collection])
+        }
+        for (collection, path), data in zip(files, shards):
+            stores[collection].update(data)
+            for key in data:
+                self._members[collection][self.shard_of(collection, key)].add(key)
+
+        # The shard counts changed since the files were written, re-shard everything
+        if any(path not in expected for _, path in files) or any(
+            self._shard_path(collection, self.shard_of(collection, key)) != path
+            for (collection, path), data in zip(files, shards)
+            for key in data
+        ):
+            self.write_all(stores)
+            for _, path in files:
+                if path not in expected:
+                    os.remove(path)
+        return True
+
+    def write(self, stores, changes, sync=False):
+        with self._lock:
+            touched = set()
+            for collection, key in changes:
+                shard = self.shard_of(collection, key)
+                if key in stores[collection]:
+                    self._members[collection][shard].add(key)
+                else:
+                    self._members[collection][shard].discard(key)
+                touched.add((collection, shard))
+            for collection, shard in sorted(touched):
+                self._write_shard(stores, collection, shard, sync)
+
+    def write_all(self, stores):
+        with self._lock:
+            for collection in COLLECTIONS:
+                members = [set() for _ in range(self.shard_counts[collection])]
+                for key in stores[collection]:
+                    members[self.shard_of(collection, key)].add(key)
+                self._members[collection] = members
+                for shard in range(self.shard_counts[collection]):
+                    self._write_shard(stores, collection, shard, True)
+
+    def _shard_path(self, collection, shard):
+        return os.path.join(self.directory, collection, f"shard-{shard:02d}.json")
+
+    def _read_shard(self, path):
+        with open(path, "r") as file:
+            return json.load(file)
+
+    def _write_shard(self, stores, collection, shard, sync):
+        store = stores[collection]
+        data = {key: store[key] for key in self._members[collection][shard] if key in store}
+
+        path = self._shard_path(collection, shard)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_epoch(value):
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    # Usage: python storage.py database.json database.db
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python storage.py <database.json> <database.db>")
+    SqliteStorage(sys.argv[2]).migrate(sys.argv[1])
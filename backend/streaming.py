@@ -0,0 +1,59 @@
+from flask import current_app, request
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Encoded items are written out in chunks of about this size
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def wants_ndjson():
+    """
+    True if the client asked for newline-delimited JSON through its Accept header.
+    """
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_list(items, envelope=None, field=None, ndjson=False):
+    """
+    A response that encodes `items` one at a time while it is sent, so only
+    one chunk of the body is ever held in memory.
+
+    As JSON the body is the array itself, or, with `field`, an object holding
+    the array under `field` next to the `envelope` values, e.g.
+    {"brands": [...], "total": 3}. As NDJSON every item is one line and the
+    envelope values are sent as headers instead (total -> X-Total).
+    """
+    dumps = current_app.json.dumps
+    envelope = envelope or {}
+
+    def encode(item):
+        return dumps(item, separators=(",", ":"))
+
+    def chunks(head, separator, tail, line_end=""):
+        buffer, size = [head], len(head)
+        for index, item in enumerate(items):
+            text = (separator if index else "") + encode(item) + line_end
+            buffer.append(text)
+            size += len(text)
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(buffer).encode()
+                buffer, size = [], 0
+        buffer.append(tail)
+        yield "".join(buffer).encode()
+
+    if ndjson:
+        response = current_app.response_class(chunks("", "", "", "\n"), mimetype=NDJSON_MIMETYPE)
+        for key, value in envelope.items():
+            if value is not None:
+                response.headers["X-" + key.replace("_", "-").title()] = str(value)
+        return response
+
+    if field is None:
+        head, tail = "[", "]"
+    else:
+        # Same key order as jsonify
+        keys = sorted([*envelope, field])
+        before = [f"{encode(key)}:{encode(envelope[key])}," for key in keys[:keys.index(field)]]
+        after = [f",{encode(key)}:{encode(envelope[key])}" for key in keys[keys.index(field) + 1:]]
+        head = "{" + "".join(before) + encode(field) + ":["
+        tail = "]" + "".join(after) + "}"
+    return current_app.response_class(chunks(head, ",", tail), mimetype="application/json")
@@ -0,0 +1,264 @@
+import bisect
+import heapq
+import threading
+from collections import Counter
+from search_index import tokenize
+
+# Suggestions returned when the request does not ask for a number
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+# Words left out when comparing category names, as in "Sweats and Hoodies" -> "sweats-hoodies"
+CATEGORY_STOP_WORDS = {"and"}
+
+
+def _popularity(product):
+    return product.get("click_count", 0) + len(set(product.get("wishlister_users", [])))
+
+
+def _category_words(name):
+    """
+    The words identifying a category, singular and without stop words, so that
+    "T-Shirt", "T-Shirts" and the key "t-shirts" all give ("t", "shirt").
+    """
+    return tuple(
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in tokenize(name)
+        if word not in CATEGORY_STOP_WORDS
+    )
+
+
+class SuggestIndex:
+    """
+    Typeahead over product names, brand names and the categories of
+    categories_new.json. Product categories are matched to its keys by
+    _category_words, and a category is labelled with the spelling most of its
+    products use ("Men's Clothing" for "mens-clothing"), or one made from the
+    key while no product uses it.
+
+    Suggestions are ranked by popularity: click count plus wishlisters for a
+    product, and the sum over their products for brands and categories.
+
+    Every word keeps the suggestions whose label contains it in a list sorted
+    by rank, so a one-word prefix lazily merges the lists of the words it
+    starts and stops after `limit` suggestions, however many labels match.
+    For longer prefixes every label is also stored once per word it contains,
+    as the text from that word on ("polo shirt" and "shirt" for "Polo Shirt"),
+    in one sorted list whose bisected range holds the matches.
+
+    Call refresh_product(product_id) / refresh_brand(brand_id) whenever a
+    product or brand changes, or pass None to rebuild.
+    """
+
+    def __init__(self, products, brands, categories):
+        self.products = products
+        self.brands = brands
+        self.categories = categories
+        self._lock = threading.RLock()
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._keys = []  # Sorted (text, kind, id)
+            self._labels = {}  # (kind, id) -> (label, value)
+            self._scores = {}  # (kind, id) -> popularity
+            self._contributions = {}  # product_id -> (popularity, suggestions it counts towards)
+            self._ranks = {}  # (kind, id) -> (-popularity, label, kind, id), the sort key in _ranked
+            self._ranked = {}  # word -> sorted ranks of the suggestions whose label contains it
+            self._words = []  # Sorted keys of _ranked
+            self._category_keys = {}  # (kind, _category_words of a name) -> categories_new.json key
+            self._spellings = {}  # category suggestion -> Counter of the names its products use
+            self._spelled = {}  # product_id -> ((category suggestion, name), ...) counted in _spellings
+            self._loading = True  # Append keys unsorted and sort them once at the end
+            for main_category, sub_categories in self.categories.items():
+                for kind, key in [("main_category", main_category)] + [("sub_category", sub) for sub in sub_categories]:
+                    self._category_keys.setdefault((kind, _category_words(key)), key)
+                    self._scores[(kind, key)] = 0  # Added below, once products have named and scored it
+                    self._spellings[(kind, key)] = Counter()
+            for brand_id in list(self.brands):
+                self.refresh_brand(brand_id)
+            for product_id in list(self.products):
+                self.refresh_product(product_id)
+            for suggestion in self._spellings:
+                self._add(suggestion, self._category_name(suggestion), suggestion[1], self._scores[suggestion])
+            self._keys.sort()
+            for suggestion, (label, _) in self._labels.items():
+                self._ranks[suggestion] = rank = (-self._scores[suggestion], label) + suggestion
+                for word in set(tokenize(label)):
+                    self._ranked.setdefault(word, []).append(rank)
+            for ranks in self._ranked.values():
+                ranks.sort()
+            self._words = sorted(self._ranked)
+            self._loading = False
+
+    def refresh_product(self, product_id=None):
+        if product_id is None:
+            self.rebuild()
+            return
+        with self._lock:
+            own = ("product", product_id)
+            product = self.products.get(product_id)
+            label = self._labels.get(own)
+            if product is None or label is None or label[0] != product.get("name", ""):
+                self._remove(own)
+            popularity, counted = self._contributions.pop(product_id, (0, ()))
+            for suggestion in counted:
+                if suggestion in self._scores:
+                    self._set_score(suggestion, self._scores[suggestion] - popularity)
+            renamed = set()
+            for suggestion, name in self._spelled.pop(product_id, ()):
+                self._spellings[suggestion][name] -= 1
+                renamed.add(suggestion)
+
+            if product is None:
+                self._relabel(renamed)
+                return
+            popularity = _popularity(product)
+            if own in self._labels:
+                self._set_score(own, popularity)  # Same label, only re-ranked
+            else:
+                self._add(own, product.get("name", ""), product_id, popularity)
+            spelled = []
+            for kind in ("main_category", "sub_category"):
+                name = product.get(kind, "")
+                key = self._category_keys.get((kind, _category_words(name)))
+                if key is not None:
+                    spelled.append(((kind, key), name))
+                    self._spellings[(kind, key)][name] += 1
+                    renamed.add((kind, key))
+            self._spelled[product_id] = tuple(spelled)
+            counted = (("brand", product.get("brand_id")),) + tuple(suggestion for suggestion, _ in spelled)
+            for suggestion in counted:
+                if suggestion in self._scores:
+                    self._set_score(suggestion, self._scores[suggestion] + popularity)
+            self._contributions[product_id] = (popularity, counted)
+            self._relabel(renamed)
+
+    def refresh_brand(self, brand_id=None):
+        if brand_id is None:
+            self.rebuild()
+            return
+        with self._lock:
+            suggestion = ("brand", brand_id)
+            score = self._scores.get(suggestion)
+            self._remove(suggestion)
+            brand = self.brands.get(brand_id)
+            if brand is None:
+                return
+            if score is None:
+                score = sum(
+                    popularity
+                    for popularity, counted in self._contributions.values()
+                    if suggestion in counted
+                )
+            self._add(suggestion, brand.get("name", ""), brand_id, score)
+
+    def suggest(self, prefix, limit=DEFAULT_SUGGESTIONS):
+        """
+        The `limit` most popular labels with a word starting with `prefix`, as
+        {"type", "label", "value"} dicts; value is the product id, brand id or
+        category slug.
+        """
+        text = " ".join(tokenize(prefix))
+        if not text:
+            return []
+        with self._lock:
+            if " " not in text:
+                # Highest ranked first across the words starting with the prefix
+                start = bisect.bisect_left(self._words, text)
+                ranked = []
+                for index in range(start, len(self._words)):
+                    if not self._words[index].startswith(text):
+                        break
+                    ranked.append(self._ranked[self._words[index]])
+                best = []
+                for rank in heapq.merge(*ranked):
+                    suggestion = rank[2:]
+                    if suggestion not in best:  # A label with two matching words is in both lists
+                        best.append(suggestion)
+                        if len(best) == limit:
+                            break
+            else:
+                start = bisect.bisect_left(self._keys, (text,))
+                found = set()
+                for index in range(start, len(self._keys)):
+                    key, kind, value = self._keys[index]
+                    if not key.startswith(text):
+                        break
+                    found.add((kind, value))
+                best = [rank[2:] for rank in heapq.nsmallest(limit, (self._ranks[suggestion] for suggestion in found))]
+            return [
+                {"type": kind, "label": self._labels[(kind, value)][0], "value": self._labels[(kind, value)][1]}
+                for kind, value in best
+            ]
+
+    def _category_name(self, suggestion):
+        spellings = self._spellings[suggestion]
+        name, count = max(spellings.items(), key=lambda item: item[1], default=(None, 0))
+        return name if count > 0 else _category_label(suggestion[1])
+
+    def _relabel(self, suggestions):
+        """
+        Give the categories in `suggestions` the name most of their products use now.
+        """
+        if self._loading:
+            return  # Categories are added with their labels at the end of rebuild()
+        for suggestion in suggestions:
+            label = self._category_name(suggestion)
+            if self._labels[suggestion][0] != label:
+                score = self._scores[suggestion]
+                self._remove(suggestion)
+                self._add(suggestion, label, suggestion[1], score)
+
+    def _add(self, suggestion, label, value, score=0):
+        self._labels[suggestion] = (label, value)
+        self._scores[suggestion] = score
+        words = tokenize(label)
+        for start in range(len(words)):
+            key = (" ".join(words[start:]),) + suggestion
+            if self._loading:
+                self._keys.append(key)
+            else:
+                bisect.insort(self._keys, key)
+        if not self._loading:
+            self._ranks[suggestion] = rank = (-score, label) + suggestion
+            for word in set(words):
+                ranks = self._ranked.get(word)
+                if ranks is None:
+                    ranks = self._ranked[word] = []
+                    bisect.insort(self._words, word)
+                bisect.insort(ranks, rank)
+
+    def _remove(self, suggestion):
+        entry = self._labels.pop(suggestion, None)
+        if entry is None:
+            return
+        self._scores.pop(suggestion, None)
+        words = tokenize(entry[0])
+        for start in range(len(words)):
+            key = (" ".join(words[start:]),) + suggestion
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+        rank = self._ranks.pop(suggestion, None)
+        if rank is not None:
+            for word in set(words):
+                ranks = self._ranked[word]
+                del ranks[bisect.bisect_left(ranks, rank)]
+                if not ranks:
+                    del self._ranked[word]
+                    del self._words[bisect.bisect_left(self._words, word)]
+
+    def _set_score(self, suggestion, score):
+        self._scores[suggestion] = score
+        old = self._ranks.get(suggestion)
+        if old is None or old[0] == -score:
+            return  # Still loading, ranks are built at the end
+        self._ranks[suggestion] = rank = (-score,) + old[1:]
+        for word in set(tokenize(old[1])):
+            ranks = self._ranked[word]
+            del ranks[bisect.bisect_left(ranks, old)]
+            bisect.insort(ranks, rank)
+
+
+def _category_label(slug):
+    return " ".join(word.capitalize() for word in slug.split("-"))
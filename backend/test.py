@@ -1,6 +1,15 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 import requests
 
+from persistence import FlushScheduler
+from storage import JsonStorage, ShardedJsonStorage, SqliteStorage
+
 class TestUserAuth(unittest.TestCase):
     BASE_URL = "http://localhost:9900"
     admin_email = "111@gmail.com"
@@ -9,6 +18,16 @@ class TestUserAuth(unittest.TestCase):
     user_password = "123"
     admin_token = None
     user_token = None
+    # 1x1 PNG used as a brand logo
+    tiny_logo = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+    def login(self, email, password):
+        login_response = requests.post(f"{self.BASE_URL}/user/auth/login", json={
+            "email": email,
+            "password": password
+        })
+        self.assertEqual(login_response.status_code, 200, f"Login as {email} failed.")
+        return login_response.json()["token"]
 
     def test_user_workflow(self):
         """Test the complete workflow: Register, Login, and Delete User"""
@@ -124,5 +143,654 @@ class TestUserAuth(unittest.TestCase):
         self.assertEqual(delete_brand_response.status_code, 200, "Failed to delete brand.")
         print("Brand deleted successfully.")
 
+    def test_brand_logo_workflow(self):
+        """Test that a brand logo is stored once and served from /brands/logos"""
+        admin_headers = {"Authorization": f"Bearer {self.login(self.admin_email, self.admin_password)}"}
+
+        # Step 1: Add a brand with a logo
+        print("Step 1: Adding a brand with a logo...")
+        add_brand_response = requests.post(f"{self.BASE_URL}/admin/brands", json={
+            "name": "Logo Test Brand",
+            "description": "A brand to test logos.",
+            "logo": self.tiny_logo
+        }, headers=admin_headers)
+        self.assertEqual(add_brand_response.status_code, 200, "Failed to add brand.")
+        brand_id = add_brand_response.json()["brand_id"]
+        print(f"Brand added successfully: {brand_id}")
+
+        # Step 2: Fetch the logo from its URL
+        print("Step 2: Fetching the logo...")
+        brand = requests.get(f"{self.BASE_URL}/brands/{brand_id}").json()
+        self.assertNotIn("logo", brand, "Brand still embeds its logo.")
+        filename = brand["logo_url"].rsplit("/", 1)[1]
+        self.assertTrue(filename.endswith(".png"), "Logo stored with the wrong extension.")
+        logo_response = requests.get(f"{self.BASE_URL}/brands/logos/{filename}")
+        self.assertEqual(logo_response.status_code, 200, "Fetching the logo failed.")
+        self.assertEqual(logo_response.content, base64.b64decode(self.tiny_logo), "Logo content differs.")
+        self.assertIn("immutable", logo_response.headers.get("Cache-Control", ""), "Logo is not cached as immutable.")
+        missing_response = requests.get(f"{self.BASE_URL}/brands/logos/{'0' * 64}.png")
+        self.assertEqual(missing_response.status_code, 404, "A missing logo was served.")
+        print("Logo fetched successfully.")
+
+        # Step 3: Invalid logo data
+        print("Step 3: Adding a brand with an invalid logo...")
+        invalid_response = requests.post(f"{self.BASE_URL}/admin/brands", json={
+            "name": "Broken Logo Brand",
+            "description": "Not base64.",
+            "logo": "not base64!"
+        }, headers=admin_headers)
+        self.assertEqual(invalid_response.status_code, 400, "An invalid logo was accepted.")
+        print("Invalid logo rejected.")
+
+        # Step 4: Delete Brand
+        print("Step 4: Deleting the brand...")
+        delete_brand_response = requests.delete(f"{self.BASE_URL}/admin/brands/{brand_id}", headers=admin_headers)
+        self.assertEqual(delete_brand_response.status_code, 200, "Failed to delete brand.")
+        print("Brand deleted successfully.")
+
+    def test_product_pagination_workflow(self):
+        """Test paging through /products with limit and next_cursor"""
+        # Step 1: First page
+        print("Step 1: Fetching the first page of products...")
+        first_response = requests.get(f"{self.BASE_URL}/products", params={"limit": 5})
+        self.assertEqual(first_response.status_code, 200, "Listing products failed.")
+        first_page = first_response.json()
+        for key in ("products", "total", "next_cursor"):
+            self.assertIn(key, first_page, f"Paginated listing missing {key}.")
+        self.assertLessEqual(len(first_page["products"]), 5, "Page is longer than the limit.")
+        total = first_page["total"]
+        print(f"First page complete, {total} products in total.")
+
+        # Step 2: Follow the cursors to the end
+        print("Step 2: Following next_cursor through every page...")
+        seen = [product["product_id"] for product in first_page["products"]]
+        cursor = first_page["next_cursor"]
+        while cursor is not None:
+            page_response = requests.get(f"{self.BASE_URL}/products", params={"limit": 50, "cursor": cursor})
+            self.assertEqual(page_response.status_code, 200, "Following a cursor failed.")
+            page = page_response.json()
+            self.assertEqual(page["total"], total, "Total changed between pages.")
+            seen.extend(product["product_id"] for product in page["products"])
+            cursor = page["next_cursor"]
+        self.assertEqual(len(seen), total, "Pages do not add up to the total.")
+        self.assertEqual(len(set(seen)), total, "A product was listed on two pages.")
+        print("Pagination complete.")
+
+        # Step 3: Sorted pages, price ranges and invalid parameters
+        print("Step 3: Checking a sorted page, price ranges and invalid parameters...")
+        sorted_response = requests.get(f"{self.BASE_URL}/products", params={"sort_by_price": "asc", "limit": 20})
+        self.assertEqual(sorted_response.status_code, 200, "Sorting by price failed.")
+        prices = [float(product["price"]) for product in sorted_response.json()["products"]]
+        self.assertEqual(prices, sorted(prices), "Products are not sorted by price.")
+        inverted_response = requests.get(f"{self.BASE_URL}/products", params={
+            "sort_by_price": "asc", "min_price": 200, "max_price": 100, "limit": 5
+        })
+        self.assertEqual(inverted_response.status_code, 404, "An inverted price range matched products.")
+        bad_cursor_response = requests.get(f"{self.BASE_URL}/products", params={"limit": 5, "cursor": "not-a-cursor"})
+        self.assertEqual(bad_cursor_response.status_code, 400, "An invalid cursor was accepted.")
+        print("Sorted page complete.")
+
+    def test_product_facets_workflow(self):
+        """Test that /products/facets counts agree with the filtered /products listing"""
+        # Step 1: Facets of the whole catalog
+        print("Step 1: Fetching facet counts...")
+        total = requests.get(f"{self.BASE_URL}/products", params={"limit": 1}).json()["total"]
+        facets_response = requests.get(f"{self.BASE_URL}/products/facets")
+        self.assertEqual(facets_response.status_code, 200, "Fetching facets failed.")
+        facets = facets_response.json()
+        self.assertEqual(facets["total"], total, "Facet total differs from the listing total.")
+        self.assertEqual(sum(facets["facets"]["brand"].values()), total, "Brand counts do not add up to the total.")
+        print("Facets complete.")
+
+        # Step 2: A facet count matches the listing filtered by it
+        print("Step 2: Filtering by the largest brand...")
+        brand, count = max(facets["facets"]["brand"].items(), key=lambda item: item[1])
+        brand_response = requests.get(f"{self.BASE_URL}/products", params={"brand_name": brand, "limit": 1})
+        self.assertEqual(brand_response.json()["total"], count, "Brand facet count differs from the filtered listing.")
+        filtered = requests.get(f"{self.BASE_URL}/products/facets", params={"brand_name": brand}).json()
+        self.assertEqual(filtered["total"], count, "Filtered facet total differs from the brand count.")
+        self.assertEqual(filtered["facets"]["brand"].get(brand), count, "The selected brand lost its count.")
+        print("Filtered facets complete.")
+
+    def test_keyword_search_workflow(self):
+        """Test /products keyword search, with every word matched as a prefix"""
+
+        # Step 1: Words match the start of longer words
+        print("Step 1: Searching with a word prefix...")
+        search_response = requests.get(f"{self.BASE_URL}/products", params={"keyword": "shir"})
+        self.assertEqual(search_response.status_code, 200, "Prefix search failed.")
+        texts = [
+            " ".join((product["name"], product["brand"], product["sub_category"])).lower()
+            for product in search_response.json()
+        ]
+        self.assertTrue(texts, "Prefix search found nothing.")
+        self.assertTrue(all("shir" in text for text in texts), "A product without the word was found.")
+        print("Prefix search complete.")
+
+        # Step 2: A keyword without any words matches nothing
+        print("Step 2: Searching with punctuation only...")
+        search_response = requests.get(f"{self.BASE_URL}/products", params={"keyword": "!!!"})
+        self.assertEqual(search_response.status_code, 404, "A keyword without words matched products.")
+        print("Punctuation search complete.")
+
+    def test_search_suggest_workflow(self):
+        """Test that /search/suggest follows products being added and deleted"""
+        admin_headers = {"Authorization": f"Bearer {self.login(self.admin_email, self.admin_password)}"}
+
+        # Step 1: Add a product with a distinctive name
+        print("Step 1: Adding a product to suggest...")
+        product_data = {
+            "name": "Zyzzogeton Parka",
+            "price": "150.0",
+            "previous_price": "0",
+            "main_category": "mens-clothing",
+            "sub_category": "jackets",
+            "colour": "green",
+            "brand_id": "354117646",
+            "product_url": "https://example.com/zyzzogeton-parka",
+            "status": "New",
+            "stock": "In Stock",
+            "size": ["M:1"]
+        }
+        add_product_response = requests.post(f"{self.BASE_URL}/admin/products", json=product_data, headers=admin_headers)
+        self.assertEqual(add_product_response.status_code, 200, "Failed to add product.")
+        product_id = add_product_response.json()["product_id"]
+        print(f"Product added successfully: {product_id}")
+
+        # Step 2: Suggest it from a prefix
+        print("Step 2: Requesting suggestions...")
+        suggest_response = requests.get(f"{self.BASE_URL}/search/suggest", params={"q": "zyzzog", "limit": 5})
+        self.assertEqual(suggest_response.status_code, 200, "Suggest request failed.")
+        suggestions = suggest_response.json()["suggestions"]
+        self.assertLessEqual(len(suggestions), 5, "More suggestions than the limit.")
+        self.assertIn(
+            {"label": "Zyzzogeton Parka", "type": "product", "value": product_id},
+            suggestions,
+            "New product is not suggested."
+        )
+        print("Suggestions complete.")
+
+        # Step 3: Delete it and check it is no longer suggested
+        print("Step 3: Deleting the product...")
+        delete_product_response = requests.delete(f"{self.BASE_URL}/admin/products/{product_id}", headers=admin_headers)
+        self.assertEqual(delete_product_response.status_code, 200, "Failed to delete product.")
+        suggest_response = requests.get(f"{self.BASE_URL}/search/suggest", params={"q": "zyzzog"})
+        values = [suggestion["value"] for suggestion in suggest_response.json()["suggestions"]]
+        self.assertNotIn(product_id, values, "Deleted product is still suggested.")
+        print("Product deletion complete.")
+
+        # Step 4: Categories are suggested under the names their products use
+        print("Step 4: Requesting category suggestions...")
+        suggest_response = requests.get(f"{self.BASE_URL}/search/suggest", params={"q": "sweats"})
+        self.assertIn(
+            {"label": "Sweats and Hoodies", "type": "sub_category", "value": "sweats-hoodies"},
+            suggest_response.json()["suggestions"],
+            "Category is not suggested under its product name."
+        )
+        print("Category suggestions complete.")
+
+    def test_conditional_get_workflow(self):
+        """Test that catalog reads answer 304 until the data behind them changes"""
+        admin_headers = {"Authorization": f"Bearer {self.login(self.admin_email, self.admin_password)}"}
+
+        # Step 1: Add a product to read
+        print("Step 1: Adding a product...")
+        product_data = {
+            "name": "Conditional Tee",
+            "price": "30.0",
+            "previous_price": "0",
+            "main_category": "mens-clothing",
+            "sub_category": "t-shirts",
+            "colour": "white",
+            "brand_id": "354117646",
+            "product_url": "https://example.com/conditional-tee",
+            "status": "New",
+            "stock": "In Stock",
+            "size": ["S:1"]
+        }
+        add_product_response = requests.post(f"{self.BASE_URL}/admin/products", json=product_data, headers=admin_headers)
+        self.assertEqual(add_product_response.status_code, 200, "Failed to add product.")
+        product_id = add_product_response.json()["product_id"]
+        print(f"Product added successfully: {product_id}")
+
+        # Step 2: Unchanged reads revalidate with If-None-Match
+        print("Step 2: Revalidating unchanged reads...")
+        for path in (f"/products/{product_id}", "/products?limit=5", "/brands"):
+            response = requests.get(f"{self.BASE_URL}{path}")
+            etag = response.headers.get("ETag")
+            self.assertIsNotNone(etag, f"{path} has no ETag.")
+            revalidated = requests.get(f"{self.BASE_URL}{path}", headers={"If-None-Match": etag})
+            self.assertEqual(revalidated.status_code, 304, f"Unchanged {path} was sent again.")
+        print("Revalidation complete.")
+
+        # Step 3: An edit changes the ETag
+        print("Step 3: Editing the product...")
+        etag = requests.get(f"{self.BASE_URL}/products/{product_id}").headers["ETag"]
+        edit_product_response = requests.put(f"{self.BASE_URL}/admin/products/{product_id}", json={
+            **product_data, "price": "25.0"
+        }, headers=admin_headers)
+        self.assertEqual(edit_product_response.status_code, 200, "Failed to edit product.")
+        edited = requests.get(f"{self.BASE_URL}/products/{product_id}", headers={"If-None-Match": etag})
+        self.assertEqual(edited.status_code, 200, "An edited product was answered with 304.")
+        self.assertEqual(float(edited.json()["price"]), 25.0, "The edit is missing.")
+        print("Edit seen.")
+
+        # Step 4: If-Modified-Since, once the second of the edit is over
+        print("Step 4: Revalidating with If-Modified-Since...")
+        time.sleep(1.1)
+        response = requests.get(f"{self.BASE_URL}/products/{product_id}")
+        last_modified = response.headers.get("Last-Modified")
+        self.assertIsNotNone(last_modified, "Product has no Last-Modified.")
+        revalidated = requests.get(f"{self.BASE_URL}/products/{product_id}", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(revalidated.status_code, 304, "Unmodified product was sent again.")
+        print("If-Modified-Since complete.")
+
+        # Step 5: Delete Product
+        print("Step 5: Deleting the product...")
+        delete_product_response = requests.delete(f"{self.BASE_URL}/admin/products/{product_id}", headers=admin_headers)
+        self.assertEqual(delete_product_response.status_code, 200, "Failed to delete product.")
+        print("Product deleted successfully.")
+
+    def test_response_compression_workflow(self):
+        """Test that large JSON responses are compressed for clients that accept it"""
+        # Step 1: gzip, from a fresh and from a cached listing
+        print("Step 1: Fetching a page with gzip...")
+        params = {"limit": 100, "sort_by_price": "desc"}
+        first = requests.get(f"{self.BASE_URL}/products", params=params, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(first.status_code, 200, "Listing products failed.")
+        self.assertEqual(first.headers.get("Content-Encoding"), "gzip", "Listing was not gzip compressed.")
+        second = requests.get(f"{self.BASE_URL}/products", params=params, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(second.headers.get("Content-Encoding"), "gzip", "Cached listing was not gzip compressed.")
+        self.assertEqual(
+            [product["product_id"] for product in second.json()["products"]],
+            [product["product_id"] for product in first.json()["products"]],
+            "Cached compressed listing differs."
+        )
+        print("gzip complete.")
+
+        # Step 2: Clients that accept no encoding
+        print("Step 2: Fetching the same page uncompressed...")
+        plain = requests.get(f"{self.BASE_URL}/products", params=params, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", plain.headers, "Listing was compressed without being accepted.")
+        self.assertIn("Accept-Encoding", plain.headers.get("Vary", ""), "Listing does not vary on Accept-Encoding.")
+        self.assertEqual(plain.json()["total"], first.json()["total"], "Uncompressed listing differs.")
+        print("Uncompressed listing complete.")
+
+        # Step 3: Small responses are not worth compressing
+        print("Step 3: Fetching a small response...")
+        small = requests.get(f"{self.BASE_URL}/search/suggest", params={"q": "qqqqzzzz"}, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(small.status_code, 200, "Suggest request failed.")
+        self.assertNotIn("Content-Encoding", small.headers, "A small response was compressed.")
+        print("Small response complete.")
+
+    def test_ndjson_workflow(self):
+        """Test listing products and brands as newline-delimited JSON"""
+        ndjson_headers = {"Accept": "application/x-ndjson"}
+
+        # Step 1: A page of products
+        print("Step 1: Fetching a page of products as NDJSON...")
+        page = requests.get(f"{self.BASE_URL}/products", params={"limit": 20}).json()
+        response = requests.get(f"{self.BASE_URL}/products", params={"limit": 20}, headers=ndjson_headers)
+        self.assertEqual(response.status_code, 200, "NDJSON listing failed.")
+        self.assertTrue(response.headers["Content-Type"].startswith("application/x-ndjson"), "Wrong content type.")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(
+            [product["product_id"] for product in lines],
+            [product["product_id"] for product in page["products"]],
+            "NDJSON lines differ from the JSON page."
+        )
+        self.assertEqual(response.headers.get("X-Total"), str(page["total"]), "X-Total differs from total.")
+        print("Product page complete.")
+
+        # Step 2: Brands
+        print("Step 2: Fetching brands as NDJSON...")
+        brands = requests.get(f"{self.BASE_URL}/brands", params={"limit": 50}).json()
+        response = requests.get(f"{self.BASE_URL}/brands", params={"limit": 50}, headers=ndjson_headers)
+        self.assertEqual(response.status_code, 200, "NDJSON brands failed.")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(lines, brands["brands"], "NDJSON brands differ from the JSON listing.")
+        self.assertEqual(response.headers.get("X-Total"), str(brands["total"]), "X-Total differs from total.")
+        print("Brands complete.")
+
+    def test_product_events_workflow(self):
+        """Test recording a batch of click events, with invalid events rejected"""
+        product_id = requests.get(f"{self.BASE_URL}/products", params={"limit": 1}).json()["products"][0]["product_id"]
+
+        # Step 1: A batch mixing valid and invalid events
+        print("Step 1: Posting a batch of events...")
+        events = [
+            {"product_id": product_id, "type": "click"},
+            {"product_id": product_id, "type": "clickthrough", "ts": "2024-05-01T10:00:00Z"},
+            {"product_id": product_id, "type": "view"},
+            {"product_id": "no-such-product", "type": "click"},
+            {"product_id": product_id, "type": "click", "ts": "yesterday"},
+            "click",
+        ]
+        batch_response = requests.post(f"{self.BASE_URL}/products/events:batch", json=events)
+        self.assertEqual(batch_response.status_code, 200, "Posting events failed.")
+        result = batch_response.json()
+        self.assertEqual(result["accepted"], 2, "Valid events were not accepted.")
+        self.assertEqual([rejection["index"] for rejection in result["rejected"]], [2, 3, 4, 5], "Wrong events rejected.")
+        print("Batch complete.")
+
+        # Step 2: Numeric product ids, as some listings return them
+        print("Step 2: Posting an event with a numeric product id...")
+        batch_response = requests.post(f"{self.BASE_URL}/products/events:batch", json=[
+            {"product_id": int(product_id), "type": "click"}
+        ])
+        self.assertEqual(batch_response.json()["accepted"], 1, "A numeric product id was rejected.")
+        print("Numeric product id accepted.")
+
+        # Step 3: A body that is not a list
+        print("Step 3: Posting a single event instead of a list...")
+        batch_response = requests.post(f"{self.BASE_URL}/products/events:batch", json=events[0])
+        self.assertEqual(batch_response.status_code, 400, "A body that is not a list was accepted.")
+        print("Invalid body rejected.")
+
+        # Step 4: Non-finite timestamps
+        print("Step 4: Posting events with NaN and Infinity timestamps...")
+        body = (
+            f'[{{"product_id": "{product_id}", "type": "click", "ts": NaN}},'
+            f' {{"product_id": "{product_id}", "type": "click", "ts": Infinity}}]'
+        )
+        batch_response = requests.post(f"{self.BASE_URL}/products/events:batch", data=body, headers={
+            "Content-Type": "application/json"
+        })
+        self.assertEqual(batch_response.status_code, 200, "Posting events failed.")
+        result = batch_response.json()
+        self.assertEqual(result["accepted"], 0, "A non-finite timestamp was accepted.")
+        self.assertEqual(len(result["rejected"]), 2, "A non-finite timestamp was not rejected.")
+        print("Non-finite timestamps rejected.")
+
+        # Step 5: Merged clicks show up in product listings
+        print("Step 5: Clicking a product and waiting for the merge...")
+        listing = requests.get(f"{self.BASE_URL}/products", params={"limit": 1})
+        clicks = listing.json()["products"][0]["click_count"]
+        requests.post(f"{self.BASE_URL}/products/{product_id}/click")
+        for _ in range(50):
+            time.sleep(0.1)
+            merged = requests.get(f"{self.BASE_URL}/products", params={"limit": 1}, headers={
+                "If-None-Match": listing.headers["ETag"]
+            })
+            if merged.status_code == 200 and merged.json()["products"][0]["click_count"] > clicks:
+                break
+        self.assertEqual(merged.status_code, 200, "The listing ETag did not change after a merge.")
+        self.assertGreater(merged.json()["products"][0]["click_count"], clicks, "The listing click count was not updated.")
+        print("Merged clicks listed.")
+
+    def test_metrics_window_workflow(self):
+        """Test click totals over a recent window in /admin/metrics"""
+        admin_headers = {"Authorization": f"Bearer {self.login(self.admin_email, self.admin_password)}"}
+        product_id = str(requests.get(f"{self.BASE_URL}/products", params={"limit": 1}).json()["products"][0]["product_id"])
+
+        def window_metrics(window):
+            response = requests.get(f"{self.BASE_URL}/admin/metrics", params={"window": window}, headers=admin_headers)
+            self.assertEqual(response.status_code, 200, f"Fetching {window} metrics failed.")
+            return response.json()
+
+        # Step 1: Record clicks now, two hours ago and just over a day ago
+        print("Step 1: Recording clicks...")
+        hour_before, day_before = window_metrics("1h"), window_metrics("24h")
+        events = [{"product_id": product_id, "type": "click"} for _ in range(3)]
+        events.append({"product_id": product_id, "type": "click", "ts": time.time() - 2 * 3600})
+        events.append({"product_id": product_id, "type": "click", "ts": time.time() - 24 * 3600 - 60})
+        batch_response = requests.post(f"{self.BASE_URL}/products/events:batch", json=events)
+        self.assertEqual(batch_response.json()["accepted"], 5, "Click events were rejected.")
+        print("Clicks recorded.")
+
+        # Step 2: Each window only counts its own clicks
+        print("Step 2: Reading windowed metrics...")
+        hour, day = window_metrics("1h"), window_metrics("24h")
+        self.assertEqual(hour["window"], "1h", "Window missing from the response.")
+        self.assertEqual(hour["click_count"] - hour_before["click_count"], 3, "Wrong clicks in the last hour.")
+        self.assertEqual(day["click_count"] - day_before["click_count"], 4, "Wrong clicks in the last day.")
+        self.assertIn(product_id, [entry["id"] for entry in hour["top_products_clicks"]], "Clicked product not ranked.")
+        print("Windowed metrics complete.")
+
+        # Step 3: Invalid windows
+        print("Step 3: Checking invalid windows...")
+        for window in ("soon", "40d"):
+            response = requests.get(f"{self.BASE_URL}/admin/metrics", params={"window": window}, headers=admin_headers)
+            self.assertEqual(response.status_code, 400, f"Window {window} was accepted.")
+        print("Invalid windows rejected.")
+
+    def test_admin_users_workflow(self):
+        """Test searching, sorting and paging /admin/users"""
+        admin_headers = {"Authorization": f"Bearer {self.login(self.admin_email, self.admin_password)}"}
+
+        # Step 1: Search by email prefix
+        print("Step 1: Searching users by email prefix...")
+        search_response = requests.get(f"{self.BASE_URL}/admin/users", params={"q": "111@", "limit": 10}, headers=admin_headers)
+        self.assertEqual(search_response.status_code, 200, "Searching users failed.")
+        emails = [user["email"] for user in search_response.json()["users"]]
+        self.assertIn(self.admin_email, emails, "Admin not found by email prefix.")
+        self.assertTrue(all(email.lower().startswith("111@") for email in emails), "Search returned other users.")
+        print("Search complete.")
+
+        # Step 2: Sort by wishlist size and page through the result
+        print("Step 2: Paging through users sorted by wishlist size...")
+        params = {"sort_by": "wish_list_count", "limit": 25}
+        sorted_response = requests.get(f"{self.BASE_URL}/admin/users", params=params, headers=admin_headers)
+        self.assertEqual(sorted_response.status_code, 200, "Sorting users failed.")
+        page = sorted_response.json()
+        total = page["total"]
+        counts = [user["wish_list_count"] for user in page["users"]]
+        while page["next_cursor"] is not None:
+            page = requests.get(
+                f"{self.BASE_URL}/admin/users",
+                params={**params, "cursor": page["next_cursor"]},
+                headers=admin_headers
+            ).json()
+            counts.extend(user["wish_list_count"] for user in page["users"])
+        self.assertEqual(len(counts), total, "Pages do not add up to the total.")
+        self.assertEqual(counts, sorted(counts, reverse=True), "Users are not sorted by wishlist size.")
+        print("Sorting complete.")
+
+        # Step 3: Invalid parameters and non-admins
+        print("Step 3: Checking invalid parameters and access control...")
+        invalid_response = requests.get(f"{self.BASE_URL}/admin/users", params={"sort_by": "password"}, headers=admin_headers)
+        self.assertEqual(invalid_response.status_code, 400, "An invalid sort_by was accepted.")
+        user_token = requests.post(f"{self.BASE_URL}/user/auth/register", json={
+            "email": "usersearch@gmail.com",
+            "password": "password123",
+            "name": "User Search",
+            "is_admin": False
+        }).json()["token"]
+        forbidden_response = requests.get(f"{self.BASE_URL}/admin/users", headers={"Authorization": f"Bearer {user_token}"})
+        self.assertEqual(forbidden_response.status_code, 403, "A non-admin could list users.")
+        requests.delete(f"{self.BASE_URL}/user", headers={"Authorization": f"Bearer {user_token}"})
+        print("Access control complete.")
+
+
+class TestStorage(unittest.TestCase):
+    """Storage backends, used directly on a temporary directory"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    @staticmethod
+    def empty_stores():
+        return {"users": {}, "brands": {}, "products": {}}
+
+    def test_json_log_workflow(self):
+        """Test that JSON storage replays its write-ahead log and compacts it into the snapshot"""
+        path = os.path.join(self.tmp.name, "database.json")
+
+        # Step 1: Nothing stored yet
+        print("Step 1: Loading an empty database...")
+        storage = JsonStorage(path, compact_threshold=5)
+        self.assertFalse(storage.load(self.empty_stores()), "An empty database reported data.")
+        print("Empty load complete.")
+
+        # Step 2: Log a put and a delete
+        print("Step 2: Logging changes...")
+        stores = self.empty_stores()
+        stores["products"]["1"] = {"product_id": "1", "name": "Logged Shirt"}
+        stores["products"]["2"] = {"product_id": "2", "name": "Deleted Shirt"}
+        storage.write(stores, [("products", "1"), ("products", "2")])
+        del stores["products"]["2"]
+        storage.write(stores, [("products", "2")])
+        self.assertFalse(os.path.exists(path), "The snapshot was rewritten before compaction.")
+        loaded = self.empty_stores()
+        self.assertTrue(JsonStorage(path).load(loaded), "Logged changes were not found.")
+        self.assertEqual(loaded, stores, "Replaying the log gave different data.")
+        print("Log replay complete.")
+
+        # Step 3: Reach the compaction threshold
+        print("Step 3: Compacting the log...")
+        stores["users"]["a@gmail.com"] = {"email": "a@gmail.com", "name": "A"}
+        stores["brands"]["7"] = {"brand_id": "7", "name": "Seven"}
+        storage.write(stores, [("users", "a@gmail.com"), ("brands", "7")])
+        self.assertEqual(os.path.getsize(os.path.splitext(path)[0] + ".wal"), 0, "The log was not emptied.")
+        with open(path) as file:
+            self.assertEqual(json.load(file), stores, "The snapshot does not hold every change.")
+        loaded = self.empty_stores()
+        JsonStorage(path).load(loaded)
+        self.assertEqual(loaded, stores, "Loading the compacted database gave different data.")
+        print("Compaction complete.")
+
+        # Step 4: A torn record at the end of the log is dropped on load
+        print("Step 4: Recovering from a torn write...")
+        stores["products"]["3"] = {"product_id": "3", "name": "Kept Shirt"}
+        storage.write(stores, [("products", "3")])
+        with open(os.path.splitext(path)[0] + ".wal", "a") as file:
+            file.write('{"op":"put","collection":"products","key":"4","val')
+        recovered = JsonStorage(path)
+        loaded = self.empty_stores()
+        recovered.load(loaded)
+        self.assertEqual(loaded, stores, "The records before the torn write were not replayed.")
+        stores["products"]["5"] = {"product_id": "5", "name": "Later Shirt"}
+        recovered.write(stores, [("products", "5")])
+        loaded = self.empty_stores()
+        JsonStorage(path).load(loaded)
+        self.assertEqual(loaded, stores, "A change logged after the torn write was lost.")
+        print("Torn write recovery complete.")
+
+    def test_flush_scheduler_workflow(self):
+        """Test that changes reach storage at every durability level"""
+        path = os.path.join(self.tmp.name, "database.json")
+        stores = self.empty_stores()
+        scheduler = FlushScheduler(JsonStorage(path), durability="group", interval=0.01)
+
+        def stored_users():
+            loaded = self.empty_stores()
+            JsonStorage(path).load(loaded)
+            return loaded["users"]
+
+        # Step 1: A sync write is on disk when submit returns
+        print("Step 1: Writing synchronously...")
+        stores["users"]["sync@gmail.com"] = {"email": "sync@gmail.com"}
+        scheduler.submit(stores, [("users", "sync@gmail.com")], "sync")
+        self.assertIn("sync@gmail.com", stored_users(), "Sync write was not saved.")
+        print("Sync write complete.")
+
+        # Step 2: So is a group write, shared by concurrent writers
+        print("Step 2: Writing from several group writers...")
+        def group_write(email):
+            stores["users"][email] = {"email": email}
+            scheduler.submit(stores, [("users", email)], "group")
+        writers = [threading.Thread(target=group_write, args=(f"group{n}@gmail.com",)) for n in range(8)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        for n in range(8):
+            self.assertIn(f"group{n}@gmail.com", stored_users(), "Group write was not saved.")
+        print("Group writes complete.")
+
+        # Step 3: A group writer with nothing to write does not wait for a batch
+        print("Step 3: Submitting an empty change list...")
+        empty_writer = threading.Thread(target=scheduler.submit, args=(stores, [], "group"))
+        empty_writer.start()
+        empty_writer.join(timeout=5)
+        self.assertFalse(empty_writer.is_alive(), "An empty change list never returned.")
+        print("Empty change list complete.")
+
+        # Step 4: An async write is saved by close at the latest
+        print("Step 4: Writing asynchronously and closing...")
+        stores["users"]["async@gmail.com"] = {"email": "async@gmail.com"}
+        scheduler.submit(stores, [("users", "async@gmail.com")], "async")
+        scheduler.close()
+        self.assertIn("async@gmail.com", stored_users(), "Async write was lost on close.")
+        print("Async write complete.")
+
+    def test_sqlite_storage_workflow(self):
+        """Test that SQLite storage imports a JSON database and keeps later changes"""
+        json_path = os.path.join(self.tmp.name, "database.json")
+        db_path = os.path.join(self.tmp.name, "database.sqlite")
+        stores = self.empty_stores()
+        stores["brands"]["7"] = {"brand_id": "7", "name": "Seven"}
+        stores["products"]["1"] = {"product_id": "1", "name": "Shirt", "price": "20.0", "brand_id": "7"}
+        stores["products"]["2"] = {"product_id": "2", "name": "Pants", "price": "40.0", "brand_id": "7"}
+        JsonStorage(json_path).write_all(stores)
+
+        # Step 1: Seed from the JSON database
+        print("Step 1: Loading an empty SQLite database with a JSON seed...")
+        self.assertFalse(SqliteStorage(db_path).load(self.empty_stores()), "An empty database reported data.")
+        storage = SqliteStorage(db_path, seed_path=json_path)
+        loaded = self.empty_stores()
+        self.assertTrue(storage.load(loaded), "The JSON seed was not imported.")
+        self.assertEqual(loaded, stores, "The imported data differs from the seed.")
+        print("Seed import complete.")
+
+        # Step 2: Update and delete rows, then reopen
+        print("Step 2: Writing changes and reopening...")
+        stores["products"]["1"]["price"] = "15.0"
+        del stores["products"]["2"]
+        storage.write(stores, [("products", "1"), ("products", "2")], sync=True)
+        loaded = self.empty_stores()
+        SqliteStorage(db_path, seed_path=json_path).load(loaded)
+        self.assertEqual(loaded, stores, "Reopening the database gave different data.")
+        print("Changes kept.")
+
+    def test_sharded_storage_workflow(self):
+        """Test that sharded storage only rewrites the shards holding a change"""
+        json_path = os.path.join(self.tmp.name, "database.json")
+        directory = os.path.join(self.tmp.name, "shards")
+        shard_counts = {"users": 2, "brands": 2, "products": 4}
+        stores = self.empty_stores()
+        stores["users"]["a@gmail.com"] = {"email": "a@gmail.com"}
+        for n in range(20):
+            stores["products"][str(n)] = {"product_id": str(n), "name": f"Product {n}"}
+        JsonStorage(json_path).write_all(stores)
+
+        def shard_files():
+            return {
+                os.path.join(root, name): os.stat(os.path.join(root, name)).st_mtime_ns
+                for root, _, names in os.walk(directory)
+                for name in names
+            }
+
+        # Step 1: Seed the shards from the JSON database
+        print("Step 1: Seeding the shards...")
+        storage = ShardedJsonStorage(directory, shard_counts, seed_path=json_path)
+        loaded = self.empty_stores()
+        self.assertTrue(storage.load(loaded), "The JSON seed was not imported.")
+        self.assertEqual(loaded, stores, "The imported data differs from the seed.")
+        self.assertEqual(len(shard_files()), sum(shard_counts.values()), "Wrong number of shard files.")
+        print("Seed import complete.")
+
+        # Step 2: Change one product
+        print("Step 2: Changing one product...")
+        before = shard_files()
+        time.sleep(0.01)
+        stores["products"]["3"]["name"] = "Renamed Product"
+        storage.write(stores, [("products", "3")], sync=True)
+        after = shard_files()
+        rewritten = [path for path in after if after[path] != before[path]]
+        self.assertEqual(len(rewritten), 1, "More than the changed shard was rewritten.")
+        print("Single shard rewritten.")
+
+        # Step 3: Reload with a different shard count
+        print("Step 3: Reloading with more product shards...")
+        loaded = self.empty_stores()
+        ShardedJsonStorage(directory, {**shard_counts, "products": 8}).load(loaded)
+        self.assertEqual(loaded, stores, "Re-sharding lost data.")
+        loaded = self.empty_stores()
+        ShardedJsonStorage(directory, {**shard_counts, "products": 8}).load(loaded)
+        self.assertEqual(loaded, stores, "Loading the re-sharded files gave different data.")
+        print("Re-sharding complete.")
+
 if __name__ == '__main__':
     unittest.main()
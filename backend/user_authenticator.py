@@ -66,7 +66,7 @@ def register(users, products, brands):
             "notifications": [] if not is_admin else None,
         }
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", email)])
         token = generate_token(email, is_admin)
         return jsonify({"token": token})
 
@@ -98,17 +98,20 @@ def delete_user(users, products, brands):
             return jsonify({"error": "User not found"}), 404
 
         user_id = user["user_id"]
+        changes = [("users", email)]
 
-        for product in products.values():
+        for product_id, product in products.items():
             if user_id in product.get("wishlister_users", []):
                 product["wishlister_users"].remove(user_id)
+                changes.append(("products", product_id))
 
-        for brand in brands.values():
+        for brand_id, brand in brands.items():
             if user_id in brand.get("followers_list", []):
                 brand["followers_list"].remove(user_id)
+                changes.append(("brands", brand_id))
 
         del users[email]
-        save_data(users, brands, products)
+        save_data(users, brands, products, changes)
         return jsonify({"message": "User account deleted successfully"}), 200
 
     return delete_user_route
@@ -154,7 +157,7 @@ def login(users, products, brands):
             return jsonify({"error": "Invalid email or password"}), 400
 
         user["status"] = "login"
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", email)])
         token = generate_token(email, user["is_admin"])
         return jsonify({"token": token})
 
@@ -180,7 +183,7 @@ def logout(users, blacklist, products, brands):
         token = request.headers.get("Authorization").replace("Bearer ", "")
         blacklist.add(token)
         current_user["status"] = "logout"
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", current_user["email"])])
         return jsonify({"message": "Successfully logged out"})
 
     return logout_user
@@ -253,13 +256,15 @@ def edit_profile(users, products, brands):
             if new_email in users:
                 return jsonify({"error": "Email is already in use"}), 400
 
+        changes = [("users", current_user["email"])]
         if new_name:
             current_user["name"] = new_name
         if new_email:
             users[new_email] = users.pop(current_user["email"])
             current_user["email"] = new_email
+            changes.append(("users", new_email))
 
-        save_data(users, brands, products)
+        save_data(users, brands, products, changes)
         return jsonify({"message": "Profile updated successfully"}), 200
 
     return edit_profile_route
@@ -303,7 +308,7 @@ def change_password(users, products, brands):
             return jsonify({"error": "Incorrect old password"}), 400
 
         current_user["password"] = new_password
-        save_data(users, brands, products)
+        save_data(users, brands, products, [("users", current_user["email"])])
         return jsonify({"message": "Password changed successfully"}), 200
 
     return change_password_route
@@ -0,0 +1,116 @@
+import bisect
+import itertools
+import threading
+
+# Counts /admin/users can be sorted by
+SORT_FIELDS = ("wish_list_count", "followed_brand_count", "notifications_count")
+
+
+def user_summary(user):
+    """
+    The /admin/users entry of a user.
+    """
+    return {
+        "name": user.get("name", ""),
+        "email": user["email"],
+        "followed_brand_count": len(user.get("followed_brand") or []),
+        "wish_list_count": len(user.get("wish_list") or []),
+        "notifications_count": len(user.get("notifications") or []),
+    }
+
+
+class UserIndex:
+    """
+    Precomputed /admin/users entries, kept in the same order as `users`, with
+    sorted lists for prefix search on email and name and for ordering by
+    each of SORT_FIELDS, so a page never has to look at every user.
+
+    Call refresh(key) whenever a user changes, or refresh() to rebuild everything.
+    """
+
+    def __init__(self, users):
+        self.users = users
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self, key=None):
+        with self._lock:
+            if key is None:
+                self._summaries = {}
+                self._by_email = []  # Sorted (lowercase email, key)
+                self._by_name = []  # Sorted (lowercase name, key)
+                self._by_count = {field: [] for field in SORT_FIELDS}  # Sorted (-count, key)
+                for user_key, user in self.users.items():
+                    self._summaries[user_key] = summary = user_summary(user)
+                    for entries, entry in self._entries(user_key, summary):
+                        entries.append(entry)
+                for entries in [self._by_email, self._by_name, *self._by_count.values()]:
+                    entries.sort()
+                return
+
+            old = self._summaries.pop(key, None)
+            if old is not None:
+                for entries, entry in self._entries(key, old):
+                    del entries[bisect.bisect_left(entries, entry)]
+            user = self.users.get(key)
+            if user is not None:
+                self._summaries[key] = summary = user_summary(user)
+                for entries, entry in self._entries(key, summary):
+                    bisect.insort(entries, entry)
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def page(self, prefix=None, sort=None, descending=True, offset=0, limit=None):
+        """
+        Up to `limit` summaries from `offset` on, and the number of matching users.
+
+        With `prefix` only users whose email or name starts with it (ignoring
+        case) match, in email order. With `sort` (one of SORT_FIELDS) they are
+        ordered by that count instead, highest first unless not `descending`.
+        """
+        stop = None if limit is None else offset + limit
+        with self._lock:
+            if prefix:
+                keys = self._matches(prefix.lower())
+                if sort is not None:
+                    keys.sort(key=lambda user_key: self._summaries[user_key][sort], reverse=descending)
+                total = len(keys)
+                keys = keys[offset:stop]
+            elif sort is not None:
+                entries = self._by_count[sort]
+                total = len(entries)
+                if descending:
+                    keys = [user_key for _, user_key in entries[offset:stop]]
+                else:
+                    start = max(total - (total if stop is None else stop), 0)
+                    keys = [user_key for _, user_key in reversed(entries[start:max(total - offset, 0)])]
+            else:
+                total = len(self._summaries)
+                return list(itertools.islice(self._summaries.values(), offset, stop)), total
+            return [self._summaries[user_key] for user_key in keys], total
+
+    def _matches(self, prefix):
+        """
+        Keys of the users whose email or name starts with `prefix`, in email order.
+        """
+        by_email = list(self._prefix_range(self._by_email, prefix))
+        in_range = set(by_email)
+        by_name = [user_key for user_key in self._prefix_range(self._by_name, prefix) if user_key not in in_range]
+        if not by_name:
+            return by_email  # Already in email order
+        return sorted(by_email + by_name, key=lambda user_key: self._summaries[user_key]["email"].lower())
+
+    @staticmethod
+    def _prefix_range(entries, prefix):
+        for index in range(bisect.bisect_left(entries, (prefix,)), len(entries)):
+            text, user_key = entries[index]
+            if not text.startswith(prefix):
+                break
+            yield user_key
+
+    def _entries(self, key, summary):
+        yield self._by_email, (summary["email"].lower(), key)
+        yield self._by_name, (summary["name"].lower(), key)
+        for field in SORT_FIELDS:
+            yield self._by_count[field], (-summary[field], key)
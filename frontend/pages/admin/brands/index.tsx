@@ -37,7 +37,7 @@ export default function Brands() {
         const brandArray: Brand[] = Object.values(data.brands).map((brand: any) => ({
           id: brand.brand_id,
           name: brand.name,
-          followersCount: brand.followers_list.length,
+          followersCount: brand.followers_count,
         }));
         console.log("Processed brands array:", brandArray);
 
@@ -31,7 +31,7 @@ export default function UpdateBrand() {
         const data = await response.json();
         setName(data.name);
         setDescription(data.description);
-        setLogo(`data:image/jpeg;base64,${data.logo}`);
+        setLogo(data.logo_url);
       } catch {
         toast({
           title: 'Error',
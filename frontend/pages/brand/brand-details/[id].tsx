@@ -9,7 +9,7 @@ interface BrandDetailsProps {
   id: string;
   name: string;
   description: string;
-  logo: string;
+  logo_url: string;
   categories?: {
     id: string;
     name: string;
@@ -72,7 +72,7 @@ const BrandDetails = () => {
               {brand.description}
             </Text>
           </Box>
-          <Image src={`data:image/jpeg;base64,${brand.logo}`} alt={`${brand.name} logo`} boxSize="120px" />
+          <Image src={brand.logo_url} alt={`${brand.name} logo`} boxSize="120px" />
         </Flex>
 
         {/* Add HomeContent here */}
@@ -40,11 +40,6 @@ const groupBrandsByLetter = (brands) => {
   }, {});
 };
 
-// Helper function to format base64 logo
-const formatLogo = (logo, type = "png") => {
-  return `data:image/${type};base64,${logo}`;
-};
-
 const BrandListingPage = () => {
   const [searchQuery, setSearchQuery] = useState('');
   const [selectedLetter, setSelectedLetter] = useState('');
@@ -65,14 +60,14 @@ const BrandListingPage = () => {
   const fetchBrands = async () => {
     setLoading(true);
     try {
-      const response = await fetch('/api/brands');
+      const response = await fetch('/api/brands?fields=description');
       if (!response.ok) throw new Error('Failed to fetch brands');
 
       const data = await response.json();
       const brandArray = Object.values(data.brands).map((brand) => ({
         id: brand.brand_id,
         name: brand.name,
-        logo: formatLogo(brand.logo, "png"),
+        logo: brand.logo_url,
         description: brand.description || 'Brand description unavailable.',
       }));
 